@@ -0,0 +1,518 @@
+"""
+Deterministic local fixes for common pylint messages.
+
+Mechanical findings such as a missing docstring or an unused import do not
+need a model round trip. fix_lint_messages() rewrites the code for the
+messages pylint actually reported, using ast to find the statements involved
+and tokenize to rename identifiers without touching strings or comments.
+Every fixer leaves the code unchanged when it is not sure the rewrite is
+safe, so whatever is left over can still be escalated to the model.
+"""
+import ast
+import io
+import keyword
+import re
+import textwrap
+import tokenize
+
+FIXABLE_SYMBOLS = {
+    "trailing-whitespace",
+    "missing-final-newline",
+    "trailing-newlines",
+    "missing-module-docstring",
+    "missing-class-docstring",
+    "missing-function-docstring",
+    "unused-import",
+    "invalid-name",
+    "line-too-long",
+}
+
+MODULE_DOCSTRING = "Program generated by Super Python Coder, with its unit tests."
+INVALID_NAME_PATTERN = re.compile(r'^(\w+) name "([^"]+)" doesn\'t conform to (\w+) naming style')
+LINE_TOO_LONG_PATTERN = re.compile(r"\((\d+)/(\d+)\)")
+UNUSED_IMPORT_PATTERNS = (
+    re.compile(r"^Unused (\S+) imported from (\S+) as (\S+)$"),
+    re.compile(r"^Unused (\S+) imported from (\S+)$"),
+    re.compile(r"^Unused import (\S+)$"),
+    re.compile(r"^Unused (\S+) imported as (\S+)$"),
+)
+
+
+def _split_words(name):
+    """Split an identifier in any naming style into lowercase words."""
+    words = re.findall(r"[A-Z]+(?=[A-Z][a-z]|\d|\b|_)|[A-Z]?[a-z]+|[A-Z]+|\d+", name)
+    return [word.lower() for word in words]
+
+
+def convert_name(name, style):
+    """Rewrite an identifier in the given pylint naming style, or None if that is not possible."""
+    words = _split_words(name)
+    if not words:
+        return None
+    prefix = "_" * (len(name) - len(name.lstrip("_")))
+    if style == "snake_case":
+        converted = "_".join(words)
+    elif style == "UPPER_CASE":
+        converted = "_".join(words).upper()
+    elif style == "PascalCase":
+        converted = "".join(word.capitalize() for word in words)
+    elif style == "camelCase":
+        converted = words[0] + "".join(word.capitalize() for word in words[1:])
+    else:
+        return None
+    converted = prefix + converted
+    if not converted.isidentifier() or keyword.iskeyword(converted) or converted == name:
+        return None
+    return converted
+
+
+def _humanize(name):
+    """Turn an identifier into a short sentence for a docstring."""
+    words = _split_words(name) or [name]
+    return " ".join(words).capitalize() + "."
+
+
+def _lines(code):
+    return code.splitlines(keepends=True)
+
+
+def _first_line(node):
+    """First source line of a statement, decorators included."""
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+
+
+def _indent_of(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def fix_whitespace(code, line_numbers):
+    """Strip trailing whitespace from the given lines."""
+    lines = _lines(code)
+    for number in line_numbers:
+        if 0 < number <= len(lines):
+            line = lines[number - 1]
+            ending = line[len(line.rstrip("\r\n")):]
+            lines[number - 1] = line.rstrip() + ending
+    return "".join(lines)
+
+
+def fix_final_newline(code):
+    """End the code with exactly one newline."""
+    return code.rstrip() + "\n"
+
+
+def add_module_docstring(code):
+    """Insert a module docstring after any shebang and encoding comments."""
+    lines = _lines(code)
+    position = 0
+    while position < len(lines) and (
+        lines[position].startswith("#!") or re.match(r"^#.*coding[:=]", lines[position])
+    ):
+        position += 1
+    lines.insert(position, f'"""{MODULE_DOCSTRING}"""\n')
+    return "".join(lines)
+
+
+def docstring_edits(tree, line_numbers):
+    """Edits inserting docstrings into the classes and functions defined on the given lines."""
+    edits = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if node.lineno not in line_numbers or ast.get_docstring(node) is not None:
+            continue
+        first_statement = node.body[0]
+        if first_statement.lineno == node.lineno:
+            continue  # One-line definition, there is no body line to put it before
+        position = _first_line(first_statement) - 1
+        docstring = " " * first_statement.col_offset + f'"""{_humanize(node.name)}"""\n'
+        edits.append((position, position, [docstring]))
+    return edits
+
+
+def _unused_import_name(message):
+    """The bound name an unused-import message is about."""
+    for pattern in UNUSED_IMPORT_PATTERNS:
+        match = pattern.match(message)
+        if match:
+            groups = match.groups()
+            return groups[-1] if "as" in pattern.pattern else groups[0]
+    return None
+
+
+def unused_import_edits(code, tree, messages):
+    """Edits dropping the names pylint reported as unused from their import statements."""
+    unused = {}
+    for message in messages:
+        name = _unused_import_name(message.message)
+        if name:
+            unused.setdefault(message.line, set()).add(name)
+
+    lines = _lines(code)
+    edits = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Import, ast.ImportFrom)) or node.lineno not in unused:
+            continue
+        names = unused[node.lineno]
+        first, last = lines[node.lineno - 1], lines[node.end_lineno - 1]
+        # Only rewrite statements that own their lines, e.g. not "import os; import sys"
+        if first[:node.col_offset].strip() or last.rstrip("\r\n")[node.end_col_offset:].split("#")[0].strip():
+            continue
+        kept = [
+            alias for alias in node.names
+            if (alias.asname or alias.name) not in names and alias.name not in names
+        ]
+        if len(kept) == len(node.names):
+            continue
+        indent = " " * node.col_offset
+        if kept:
+            rewritten = type(node)(**{**vars(node), "names": kept})
+            replacement = [indent + ast.unparse(rewritten) + "\n"]
+        else:
+            replacement = [indent + "pass\n"] if _only_statement(tree, node) else []
+        edits.append((node.lineno - 1, node.end_lineno, replacement))
+    return edits
+
+
+def _only_statement(tree, target):
+    """True when target is the only statement of its block, so removing it needs a pass."""
+    for node in ast.walk(tree):
+        for field in ("body", "orelse", "finalbody", "handlers"):
+            block = getattr(node, field, None)
+            if isinstance(block, list) and target in block:
+                return len(block) == 1 and not isinstance(node, ast.Module)
+    return False
+
+
+def rename_identifiers(code, renames, attributes=()):
+    """
+    Rename identifiers with tokenize, leaving strings and comments alone.
+
+    Args:
+        code (str): Source code.
+        renames (dict): Old name -> new name.
+        attributes (set): Old names that are also renamed after a "." (methods, attributes).
+
+    Returns:
+        str: The rewritten code, or the original when a rename is not safe.
+    """
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return code
+    existing = {token.string for token in tokens if token.type == tokenize.NAME}
+    safe = {}
+    for old, new in renames.items():
+        if new in existing:
+            continue  # Would collide with another name
+        # Before Python 3.12 an f-string is a single token, its expressions would not be renamed
+        if any(token.type == tokenize.STRING and re.match(r"^[rbuRBU]*[fF]", token.string)
+               and re.search(rf"\b{re.escape(old)}\b", token.string) for token in tokens):
+            continue
+        safe[old] = new
+    if not safe:
+        return code
+
+    lines = _lines(code)
+    edits = []
+    significant = [token for token in tokens if token.type not in (tokenize.NL, tokenize.COMMENT)]
+    brackets = []
+    for index, token in enumerate(significant):
+        if token.type == tokenize.OP and token.string in "([{":
+            is_def = token.string == "(" and index >= 2 and significant[index - 2].string == "def"
+            brackets.append("def(" if is_def else token.string)
+        elif token.type == tokenize.OP and token.string in ")]}" and brackets:
+            brackets.pop()
+        if token.type != tokenize.NAME or token.string not in safe:
+            continue
+        after_dot = index > 0 and significant[index - 1].string == "."
+        # In f(reverse=reverse) the first name is the callee's parameter, not this variable
+        keyword_argument = (brackets[-1:] == ["("] and index + 1 < len(significant)
+                            and significant[index + 1].string == "=")
+        if keyword_argument or (after_dot and token.string not in attributes):
+            continue
+        edits.append((token.start, token.string))
+    for (row, column), old in sorted(edits, reverse=True):
+        line = lines[row - 1]
+        lines[row - 1] = line[:column] + safe[old] + line[column + len(old):]
+    return "".join(lines)
+
+
+def _bound_names(tree):
+    """
+    Names bound outside functions, and names bound inside them (parameters and locals).
+
+    Returns:
+        tuple: (module_names, function_names)
+    """
+    module_names, function_names = set(), set()
+    pending = [(tree, module_names)]
+    while pending:
+        node, names = pending.pop()
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(child.name)
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+                arguments = child.args
+                function_names.update(
+                    argument.arg
+                    for argument in [*arguments.posonlyargs, *arguments.args, *arguments.kwonlyargs,
+                                     arguments.vararg, arguments.kwarg]
+                    if argument
+                )
+                pending.append((child, function_names))
+                continue
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+            pending.append((child, names))
+    return module_names, function_names
+
+
+def fix_invalid_names(code, messages):
+    """
+    Rename the identifiers pylint reported as invalid-name to the style it expects.
+
+    Renames go by name over the whole file, so a name bound both outside and
+    inside functions (a module constant n and a parameter n) is left alone:
+    renaming one would rename the other with it.
+    """
+    try:
+        module_names, function_names = _bound_names(ast.parse(code))
+    except SyntaxError:
+        return code
+    renames = {}
+    attributes = set()
+    for message in messages:
+        match = INVALID_NAME_PATTERN.match(message.message)
+        if not match:
+            continue
+        kind, name, style = match.groups()
+        if kind == "Module" or (name in module_names and name in function_names):
+            continue
+        new_name = convert_name(name, style)
+        if new_name is None or renames.get(name, new_name) != new_name:
+            continue
+        renames[name] = new_name
+        if kind in ("Method", "Attribute", "Class attribute", "Class constant"):
+            attributes.add(name)
+    return rename_identifiers(code, renames, attributes)
+
+
+def _wrap_comment(line, max_length):
+    """Wrap a full-line comment into several comment lines."""
+    indent = _indent_of(line)
+    text = line.strip().lstrip("#").strip()
+    width = max(20, max_length - len(indent) - 2)
+    return [f"{indent}# {part}\n" for part in textwrap.wrap(text, width)]
+
+
+def _split_at_commas(line, max_length):
+    """Break a one-line statement after the commas of its first bracket that fits."""
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(line).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    indent = _indent_of(line)
+    body = line.rstrip("\r\n")
+    depth = 0
+    opening = None
+    commas = []
+    for token in tokens:
+        if token.type != tokenize.OP:
+            continue
+        if token.string in "([{":
+            depth += 1
+            if depth == 1 and opening is None:
+                opening = token.start[1]
+        elif token.string in ")]}":
+            depth -= 1
+            if depth == 0 and opening is not None:
+                closing = token.start[1]
+                break
+        elif token.string == "," and depth == 1 and opening is not None:
+            commas.append(token.start[1])
+    else:
+        return None
+    if not commas and closing - opening < 2:
+        return None
+
+    bounds = [opening + 1] + [comma + 1 for comma in commas] + [closing]
+    items = [body[start:end].strip().rstrip(",").strip() for start, end in zip(bounds, bounds[1:])]
+    items = [item for item in items if item]
+    inner = indent + "    "
+    result = [body[:opening + 1] + "\n"]
+    result += [f"{inner}{item},\n" for item in items]
+    result.append(indent + body[closing:] + "\n")
+    if any(len(part.rstrip("\n")) > max_length for part in result):
+        return None
+    return result
+
+
+def long_line_edits(code, messages):
+    """Edits shortening long lines: wrap comments, move trailing comments up, split bracketed lists."""
+    lines = _lines(code)
+    edits = []
+    for message in messages:
+        match = LINE_TOO_LONG_PATTERN.search(message.message)
+        if not match or not 0 < message.line <= len(lines):
+            continue
+        max_length = int(match.group(2))
+        line = lines[message.line - 1]
+        if line.strip().startswith("#"):
+            replacement = _wrap_comment(line, max_length)
+        else:
+            code_part, comment = _split_trailing_comment(line)
+            if comment is not None and len(code_part.rstrip()) <= max_length:
+                replacement = _wrap_comment(_indent_of(line) + comment, max_length) + [code_part.rstrip() + "\n"]
+            else:
+                replacement = _split_at_commas(line, max_length)
+        if not replacement:
+            continue
+        try:
+            ast.parse("".join(lines[:message.line - 1] + replacement + lines[message.line:]))
+        except SyntaxError:
+            continue  # e.g. the line is part of a multi-line string
+        edits.append((message.line - 1, message.line, replacement))
+    return edits
+
+
+def apply_edits(code, edits):
+    """
+    Apply (start, stop, new_lines) edits, slices of the original line list.
+
+    Edits are applied bottom-up so earlier line numbers stay valid; an edit
+    overlapping one already applied is skipped.
+    """
+    lines = _lines(code)
+    applied = []
+    lowest = len(lines) + 1
+    for start, stop, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        if stop > lowest or (start < lowest < stop):
+            continue
+        lines[start:stop] = replacement
+        lowest = start
+        applied.append((start, stop, replacement))
+    return "".join(lines), applied
+
+
+def _split_trailing_comment(line):
+    """Split a code line into its code and its trailing comment (None if there is none)."""
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(line).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return line, None
+    for token in tokens:
+        if token.type == tokenize.COMMENT:
+            column = token.start[1]
+            return line[:column], line[column:].strip()
+    return line, None
+
+
+def fix_lint_messages(code, messages):
+    """
+    Apply every local fix matching the reported messages.
+
+    Args:
+        code (str): The linted code.
+        messages (list): LintMessage tuples from lint_service.
+
+    Returns:
+        tuple: (fixed code, list of the messages a fixer was run for). The
+        original code is returned unchanged when it does not parse.
+    """
+    try:
+        ast.parse(code)
+    except SyntaxError:
+        return code, []
+
+    by_symbol = {}
+    for message in messages:
+        if message.symbol in FIXABLE_SYMBOLS:
+            by_symbol.setdefault(message.symbol, []).append(message)
+    if not by_symbol:
+        return code, []
+
+    def lines_of(*symbols):
+        return {message.line for symbol in symbols for message in by_symbol.get(symbol, [])}
+
+    handled = []
+    # Trailing whitespace keeps the line count, so the reported line numbers stay valid
+    fixed = fix_whitespace(code, lines_of("trailing-whitespace"))
+    handled += by_symbol.get("trailing-whitespace", [])
+
+    # Line based edits, all computed against the same line numbers and applied bottom-up
+    tree = ast.parse(fixed)
+    edits = (
+        docstring_edits(tree, lines_of("missing-function-docstring", "missing-class-docstring"))
+        + unused_import_edits(fixed, tree, by_symbol.get("unused-import", []))
+        + long_line_edits(fixed, by_symbol.get("line-too-long", []))
+    )
+    if edits:
+        candidate, _ = apply_edits(fixed, edits)
+        if _parses(candidate):
+            fixed = candidate
+            for symbol in ("missing-function-docstring", "missing-class-docstring", "unused-import", "line-too-long"):
+                handled += by_symbol.get(symbol, [])
+
+    # Whole-file rewrites that do not depend on line numbers
+    whole_file = [
+        ("invalid-name", lambda source: fix_invalid_names(source, by_symbol["invalid-name"])),
+        ("missing-module-docstring", add_module_docstring),
+        ("missing-final-newline", fix_final_newline),
+        ("trailing-newlines", fix_final_newline),
+    ]
+    for symbol, fix in whole_file:
+        if symbol not in by_symbol:
+            continue
+        candidate = fix(fixed)
+        if _parses(candidate):
+            fixed = candidate
+            handled += by_symbol[symbol]
+    return fixed, handled
+
+
+def _parses(code):
+    try:
+        ast.parse(code)
+    except SyntaxError:
+        return False
+    return True
+
+
+def fix_until_stable(code, lint, verify=None, max_passes=3):
+    """
+    Lint, fix locally and re-lint until nothing more can be fixed.
+
+    Args:
+        code (str): The code to fix.
+        lint (callable): Lints a code string and returns a LintResult.
+        verify (callable): Optional check that fixed code still works (e.g. its
+            tests pass); a fix failing it is discarded.
+        max_passes (int): Maximum number of fix/re-lint rounds.
+
+    Renames are applied and checked apart from the other fixes, so a rename
+    that breaks the code does not also throw away the docstrings and import
+    fixes of the same round.
+
+    Returns:
+        tuple: (code, LintResult) for the best version found.
+    """
+    lint_result = lint(code)
+    for _ in range(max_passes):
+        improved = False
+        for renames in (False, True):
+            if lint_result.clean:
+                break
+            messages = [message for message in lint_result.messages
+                        if (message.symbol == "invalid-name") == renames]
+            fixed_code, handled = fix_lint_messages(code, messages)
+            if not handled or fixed_code == code:
+                continue
+            fixed_result = lint(fixed_code)
+            if fixed_result.score < lint_result.score or (verify is not None and not verify(fixed_code)):
+                continue
+            code, lint_result = fixed_code, fixed_result
+            improved = True
+        if not improved:
+            break
+    return code, lint_result
@@ -0,0 +1,325 @@
+"""
+Non-interactive batch mode for Super Python Coder.
+
+Runs many program prompts through the generate -> optimize -> lint pipeline
+at once. Every job runs the stages of superpythoncoder in a worker thread,
+while the model calls of all jobs run on one asyncio event loop through a
+shared AsyncOpenAI client. Every job gets its own workspace directory so
+concurrent jobs never overwrite each other's code, and every job writes a
+summary.json describing how it went.
+
+Usage:
+    python batch.py prompts.txt --concurrency 8
+    python batch.py --all-programs
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+
+from colorama import Fore
+
+import superpythoncoder
+from benchmark import add_benchmark_arguments, benchmark_settings_from_args
+from cache import add_cache_arguments, cache_from_args
+from lint_service import LintService
+from sandbox import SandboxPool, add_sandbox_arguments, sandbox_from_args
+from scheduler import RequestScheduler, add_scheduler_arguments, scheduler_from_args
+from streaming import stream_completion_async
+from superpythoncoder import (
+    CODE_FILE,
+    MODEL,
+    PROGRAMS_LIST,
+    generate_program_with_openai,
+    generate_program_with_openai_for_lint,
+    optimized_code_with_openai,
+    run_lint_check,
+)
+from tracing import annotate, record_usage, tracer
+
+
+def load_prompts(path):
+    """
+    Read program prompts from a file.
+
+    A .json file must contain a list of strings. Any other file holds one
+    prompt per block, with blocks separated by blank lines, so multi-line
+    prompts like the ones in PROGRAMS_LIST can be written as-is.
+
+    Args:
+        path (str): Path of the prompts file.
+
+    Returns:
+        list: The prompts, in file order.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".json"):
+            return [str(prompt) for prompt in json.load(file)]
+        text = file.read()
+    blocks = [block.strip() for block in text.replace("\r\n", "\n").split("\n\n")]
+    return [block for block in blocks if block]
+
+
+class BatchSession:
+    """
+    State shared by every job of a batch run.
+
+    Args:
+        cache (ResponseCache): Response cache, or None to always call the model.
+        benchmark_settings (dict): Keyword arguments for compare_programs.
+        sandbox (SandboxPool): Warm workers running the generated code.
+        lint_service (LintService): In-process pylint shared by all jobs.
+        stream (bool): Stream and validate completions as they arrive.
+        test_timeout (float): Wall-clock limit per test case, in seconds.
+        candidates (int): Candidate answers sampled per model call.
+        scheduler (RequestScheduler): Rate limits and retries of the model calls of all jobs.
+        jobs (int): Jobs running at once, each with a thread for its stages.
+    """
+
+    def __init__(self, cache=None, benchmark_settings=None, sandbox=None, lint_service=None,
+                 stream=False, test_timeout=5.0, candidates=1, scheduler=None, jobs=1):
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler()
+        self.stream = stream
+        self.test_timeout = test_timeout
+        self.candidates = max(1, candidates)
+        self.stream_stats = []
+        self.benchmark_settings = benchmark_settings or {}
+        self.sandbox = sandbox or SandboxPool()
+        self.lint_service = lint_service or LintService()
+        self._client = None
+        # Not the loop's default executor: the model calls need that one (e.g. for DNS lookups)
+        # while every stage thread is blocked waiting for them
+        self._stage_threads = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs))
+
+    @property
+    def client(self):
+        """The shared AsyncOpenAI client, created on first use."""
+        if self._client is None:
+            self._client = self.scheduler.async_openai_client(os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    def install(self, loop):
+        """
+        Point the pipeline of superpythoncoder at this session.
+
+        Its stages then run unchanged in the job threads, with their model
+        calls sent to complete() on the given event loop.
+        """
+        superpythoncoder.response_cache = self.cache
+        superpythoncoder.scheduler = self.scheduler
+        superpythoncoder.benchmark_settings = self.benchmark_settings
+        superpythoncoder.sandbox = self.sandbox
+        superpythoncoder.lint_service = self.lint_service
+        superpythoncoder.test_timeout = self.test_timeout
+        superpythoncoder.candidates = self.candidates
+        superpythoncoder.stream_responses = self.stream
+        superpythoncoder.model_call = (loop, self.complete)
+
+    async def complete(self, messages, n, stage):
+        """
+        Sample n answers to messages through the scheduler.
+
+        Returns:
+            list: The content of every answer, not yet cleaned.
+        """
+        if self.stream:
+            streams = await asyncio.gather(*(
+                stream_completion_async(
+                    self.client, MODEL, messages,
+                    send=lambda request, usage_of: self.scheduler.call_async(
+                        request, messages, stage, model=MODEL, usage_of=usage_of
+                    ),
+                )
+                for _ in range(n)
+            ))
+            for _, stats in streams:
+                self.stream_stats.append(stats)
+                record_usage(stats["usage"])
+            annotate(ttft=streams[0][1]["ttft"], time_to_valid_code=streams[0][1]["time_to_valid_code"],
+                     restarts=sum(stats["restarts"] for _, stats in streams))
+            return [code for code, _ in streams]
+        params = {"n": n} if n > 1 else {}
+        response = await self.scheduler.call_async(
+            lambda: self.client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                **params,
+            ),
+            messages, stage, n=n, model=MODEL, usage_of=lambda response: response.usage,
+        )
+        record_usage(response.usage)
+        return [choice.message.content for choice in response.choices]
+
+    async def run_stage(self, function, *args, **kwargs):
+        """Run a blocking pipeline function on a stage thread, in a copy of the current context."""
+        # The copied context keeps the spans of the stage nested under the job span
+        call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._stage_threads, call)
+
+    async def close(self):
+        """Close the client if one was created, and stop the stage threads and sandbox workers."""
+        superpythoncoder.model_call = None
+        if self._client is not None:
+            await self._client.close()
+        self._stage_threads.shutdown()
+        self.sandbox.close()
+
+
+async def timed(summary, stage, coroutine):
+    """Await a stage coroutine and record its duration in the job summary."""
+    start_time = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        summary["stages"][stage] = {"duration": time.perf_counter() - start_time}
+
+
+async def run_job(session, semaphore, job_id, user_input, output_dir):
+    """
+    Run one prompt through the whole pipeline in its own workspace.
+
+    Args:
+        session (BatchSession): State shared by all jobs.
+        semaphore (asyncio.Semaphore): Limits how many jobs run at once.
+        job_id (str): Name of the job and of its workspace directory.
+        user_input (str): The program prompt.
+        output_dir (str): Directory holding all job workspaces.
+
+    Returns:
+        dict: The job summary, also written to <workspace>/summary.json.
+    """
+    workspace = os.path.join(output_dir, job_id)
+    os.makedirs(workspace, exist_ok=True)
+    code_file = os.path.join(workspace, CODE_FILE)
+    summary = {
+        "job_id": job_id,
+        "prompt": user_input,
+        "workspace": workspace,
+        "status": "pending",
+        "stages": {},
+        "error": None,
+    }
+
+    async with semaphore:
+        with tracer.span("job", job_id=job_id) as span:
+            start_time = time.perf_counter()
+            try:
+                code, passed = await timed(
+                    summary, "generate", session.run_stage(generate_program_with_openai, user_input, code_file)
+                )
+                if not passed:
+                    summary["status"] = "failed"
+                else:
+                    optimized_code = await timed(
+                        summary, "optimize", session.run_stage(optimized_code_with_openai, code, code_file)
+                    )
+                    summary["optimized"] = optimized_code != code
+                    code = await timed(summary, "lint", session.run_stage(
+                        generate_program_with_openai_for_lint, optimized_code, code_file=code_file
+                    ))
+                    # A cache hit of the lint service, the lint stage just linted this code
+                    summary["lint_clean"] = (await session.run_stage(run_lint_check, code, code_file)).clean
+                    summary["status"] = "passed"
+            except Exception as e:  # one broken job must not take the batch down
+                summary["status"] = "error"
+                summary["error"] = repr(e)
+            summary["duration"] = time.perf_counter() - start_time
+            span["outcome"] = summary["status"]
+
+    with open(os.path.join(workspace, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+    color = Fore.GREEN if summary["status"] == "passed" else Fore.RED
+    print(color + f"[{job_id}] {summary['status']} in {summary['duration']:.1f}s")
+    return summary
+
+
+async def run_batch(prompts, output_dir="batch_runs", concurrency=4, cache=None,
+                    benchmark_settings=None, sandbox=None, stream=False, test_timeout=5.0, candidates=1,
+                    scheduler=None, lint_service=None):
+    """
+    Run every prompt through the pipeline with at most `concurrency` jobs in flight.
+
+    Args:
+        prompts (list): Program prompts to code.
+        output_dir (str): Directory that receives one workspace per job.
+        concurrency (int): Maximum number of jobs running at once.
+        cache (ResponseCache): Response cache shared by all jobs, or None.
+        benchmark_settings (dict): Keyword arguments for compare_programs.
+        sandbox (SandboxPool): Warm workers shared by all jobs (one is started if None).
+        stream (bool): Stream completions; their timings go to stream_stats.json.
+        test_timeout (float): Wall-clock limit per test case, in seconds.
+        candidates (int): Candidate answers sampled per model call.
+        scheduler (RequestScheduler): Rate limits shared by every model call (defaults apply if None).
+        lint_service (LintService): In-process pylint shared by all jobs (one is created if None).
+
+    Returns:
+        list: The job summaries, in prompt order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    session = BatchSession(cache, benchmark_settings, sandbox, lint_service, stream=stream,
+                           test_timeout=test_timeout, candidates=candidates, scheduler=scheduler, jobs=concurrency)
+    session.install(asyncio.get_running_loop())
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    try:
+        summaries = await asyncio.gather(*(
+            run_job(session, semaphore, f"job-{index:03d}", prompt, output_dir)
+            for index, prompt in enumerate(prompts, start=1)
+        ))
+    finally:
+        await session.close()
+
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump(summaries, file, indent=2)
+    if stream:
+        with open(os.path.join(output_dir, "stream_stats.json"), "w", encoding="utf-8") as file:
+            json.dump(session.stream_stats, file, indent=2)
+    tracer.export_jsonl(os.path.join(output_dir, "trace.jsonl"))
+    tracer.export_prometheus(os.path.join(output_dir, "metrics.prom"))
+    print(Fore.CYAN + tracer.summary_table())
+    print(Fore.CYAN + session.scheduler.summary())
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run many program prompts through Super Python Coder.")
+    parser.add_argument("prompts_file", nargs="?", help="file with one prompt per blank-line separated block, or a JSON list")
+    parser.add_argument("--all-programs", action="store_true", help="run every prompt in PROGRAMS_LIST")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of jobs running at once")
+    parser.add_argument("--output-dir", default="batch_runs", help="directory for job workspaces and summaries")
+    parser.add_argument("--stream", action="store_true", help="stream completions and abort malformed answers early")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="candidate answers sampled per model call, checked concurrently")
+    add_cache_arguments(parser)
+    add_benchmark_arguments(parser)
+    add_sandbox_arguments(parser)
+    add_scheduler_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.all_programs:
+        prompts = list(PROGRAMS_LIST)
+    elif args.prompts_file:
+        prompts = load_prompts(args.prompts_file)
+    else:
+        parser.error("give a prompts file or --all-programs")
+
+    summaries = asyncio.run(
+        run_batch(
+            prompts, args.output_dir, args.concurrency,
+            cache_from_args(args), benchmark_settings_from_args(args), sandbox_from_args(args),
+            stream=args.stream, test_timeout=args.test_timeout, candidates=args.candidates,
+            scheduler=scheduler_from_args(args),
+        )
+    )
+    passed = sum(summary["status"] == "passed" for summary in summaries)
+    print(Fore.CYAN + f"{passed}/{len(summaries)} jobs passed. Summaries in {args.output_dir}")
+    return 0 if passed == len(summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,616 @@
+"""
+Benchmark harness used to decide whether optimized code is really faster.
+
+Two complementary measurements feed the decision:
+
+* Whole-program runs: both files are run several times after a warmup, in
+  alternating random order, with wall time, CPU time and peak memory
+  recorded per run. The medians are
+  compared with a bootstrap confidence interval, so a difference only
+  counts when it is larger than the run-to-run noise.
+* In-process scaling: a function both versions define is timed at growing
+  input sizes in a sandboxed child process, alternating calls of the two
+  versions on the same inputs. Sizes double from 1 for as long as a call
+  stays within a small time budget, so exponential algorithms (e.g.
+  N-Queens) stop at the sizes they can handle. Asymptotic wins (e.g.
+  O(n^2) -> O(n log n)) show up at the larger sizes even when small inputs
+  tie; they only count when the per-size timings differ significantly at
+  several of the largest sizes.
+
+The result is a plain dict that write_report() saves as JSON.
+"""
+import ast
+import contextlib
+import importlib.util
+import inspect
+import io
+import json
+import math
+import os
+import random
+import statistics
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from sandbox import SandboxPool
+from tracing import traced, tracer
+
+DEFAULT_SIZES = tuple(2 ** power for power in range(13))  # 1 .. 4096
+INPUT_KINDS = ("int", "list", "str")
+MIN_SCALING_CALLS = 5  # Timings per size and version, enough for a bootstrap interval
+SCALING_DECIDING_SIZES = 3  # A scaling win must hold at this many of the largest common sizes
+SCALING_TIME_BUDGET = 3.0  # Seconds for a whole scaling profile, module imports aside
+SCALING_CALL_BUDGET = 0.05  # Sizes stop growing before a call would take longer than this, in seconds
+SCALING_STARTUP_TIME = 2.0  # Seconds allowed on top of the budget for importing both files
+
+
+class BenchmarkError(RuntimeError):
+    """Raised when a benchmarked program exits with an error."""
+
+
+def run_script_once(code_file, timeout=None):
+    """
+    Run a Python file once and measure it.
+
+    Returns:
+        dict: wall (s), cpu (s, None when unavailable), max_rss_kb (None when
+        unavailable) and returncode.
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.basename(code_file)],
+        cwd=os.path.dirname(code_file) or ".",
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if hasattr(os, "wait4") and timeout is None:
+        # wait4 reports the rusage of this one child, unlike RUSAGE_CHILDREN
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start_time
+        process.returncode = os.waitstatus_to_exitcode(status)
+        max_rss_kb = usage.ru_maxrss
+        if sys.platform == "darwin":
+            max_rss_kb //= 1024  # macOS reports bytes
+        return {
+            "wall": wall,
+            "cpu": usage.ru_utime + usage.ru_stime,
+            "max_rss_kb": max_rss_kb,
+            "returncode": process.returncode,
+        }
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise BenchmarkError(f"{code_file} did not finish within {timeout}s")
+    return {
+        "wall": time.perf_counter() - start_time,
+        "cpu": None,
+        "max_rss_kb": None,
+        "returncode": process.returncode,
+    }
+
+
+def measure(old_run, new_run, warmup=1, repeats=7, seed=0):
+    """
+    Collect benchmark samples of two versions, interleaved.
+
+    Each round runs both versions once, in random order, so drift over the
+    measurement (thermal, caches, other load) hits both alike instead of
+    ending up in the comparison.
+
+    Args:
+        old_run (callable): Returns one sample dict of the baseline per call, like run_script_once.
+        new_run (callable): Same for the candidate.
+        warmup (int): Rounds discarded before measuring (filesystem and import caches).
+        repeats (int): Measured rounds.
+        seed (int): Seed of the run order.
+
+    Returns:
+        tuple: (old_samples, new_samples)
+    """
+    rng = random.Random(seed)
+    runs = [("old", old_run), ("new", new_run)]
+    samples = {"old": [], "new": []}
+    for round_number in range(warmup + repeats):
+        is_warmup = round_number < warmup
+        rng.shuffle(runs)
+        for version, run_once in runs:
+            with tracer.span("benchmark.run", warmup=is_warmup, version=version):
+                sample = run_once()
+            if is_warmup:
+                continue
+            if sample["returncode"] != 0:
+                raise BenchmarkError(f"Benchmarked program exited with status {sample['returncode']}")
+            samples[version].append(sample)
+    return samples["old"], samples["new"]
+
+
+def summarize(samples):
+    """Reduce samples to medians, spread and peak memory."""
+    walls = [sample["wall"] for sample in samples]
+    cpus = [sample["cpu"] for sample in samples if sample["cpu"] is not None]
+    rss = [sample["max_rss_kb"] for sample in samples if sample["max_rss_kb"] is not None]
+    return {
+        "runs": len(samples),
+        "median_wall": statistics.median(walls),
+        "min_wall": min(walls),
+        "stdev_wall": statistics.stdev(walls) if len(walls) > 1 else 0.0,
+        "median_cpu": statistics.median(cpus) if cpus else None,
+        "peak_rss_kb": max(rss) if rss else None,
+    }
+
+
+def bootstrap_ci(old, new, confidence=0.95, resamples=2000, seed=0):
+    """
+    Bootstrap confidence interval of the relative change of the median.
+
+    The change is (median(new) - median(old)) / median(old), so a negative
+    interval means the new version is faster.
+
+    Returns:
+        tuple: (low, high)
+    """
+    rng = random.Random(seed)
+    changes = []
+    for _ in range(resamples):
+        old_median = statistics.median(rng.choices(old, k=len(old)))
+        new_median = statistics.median(rng.choices(new, k=len(new)))
+        changes.append((new_median - old_median) / old_median)
+    changes.sort()
+    tail = (1 - confidence) / 2
+    low = changes[int(tail * (resamples - 1))]
+    high = changes[int(math.ceil((1 - tail) * (resamples - 1)))]
+    return low, high
+
+
+def compare_samples(old, new, confidence=0.95, min_improvement=0.02):
+    """
+    Compare two lists of timings.
+
+    Args:
+        old (list): Baseline timings in seconds.
+        new (list): Candidate timings in seconds.
+        confidence (float): Confidence level of the interval (significance is 1 - confidence).
+        min_improvement (float): Smallest relative change that counts, e.g. 0.02 for 2%.
+
+    Returns:
+        dict: relative_change, ci, faster and slower. faster/slower are only
+        True when the whole interval lies beyond min_improvement.
+    """
+    change = (statistics.median(new) - statistics.median(old)) / statistics.median(old)
+    low, high = bootstrap_ci(old, new, confidence)
+    return {
+        "relative_change": change,
+        "ci": [low, high],
+        "confidence": confidence,
+        "faster": high < -min_improvement,
+        "slower": low > min_improvement,
+    }
+
+
+def make_input(kind, size, rng):
+    """Build a benchmark input of the given kind and size."""
+    if kind == "int":
+        return size
+    if kind == "list":
+        return [rng.randrange(size * 10) for _ in range(size)]
+    return "".join(rng.choice(string.ascii_letters) for _ in range(size))
+
+
+def _load_module(code_file, name="benchmarked_code"):
+    """Import a generated file without running its __main__ block or its output."""
+    spec = importlib.util.spec_from_file_location(name, code_file)
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def _helper_names(code_file):
+    """Names of the top-level functions that other top-level functions call, e.g. is_safe."""
+    with open(code_file, "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read())
+    functions = [node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    names = {function.name for function in functions}
+    helpers = set()
+    for function in functions:
+        for child in ast.walk(function):
+            if isinstance(child, ast.Name) and child.id in names and child.id != function.name:
+                helpers.add(child.id)
+    return helpers
+
+
+def _candidate_functions(module):
+    """
+    Top-level functions of the module that take positional arguments, tests excluded.
+
+    Functions no other function calls come first, so the entry point of the
+    algorithm is scaled rather than one of its helpers.
+    """
+    helpers = _helper_names(module.__file__)
+    found = []
+    for name, function in vars(module).items():
+        if not inspect.isfunction(function) or function.__module__ != module.__name__:
+            continue
+        if name.startswith(("test", "_")) or name == "main":
+            continue
+        required = [
+            parameter for parameter in inspect.signature(function).parameters.values()
+            if parameter.default is parameter.empty
+            and parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+        ]
+        if required:
+            found.append((name, function, len(required)))
+    return sorted(found, key=lambda candidate: candidate[0] in helpers)
+
+
+def _arguments(kind, size, arity, seed):
+    """Fresh call arguments; the same seed gives both versions equal inputs."""
+    rng = random.Random(seed)
+    return [make_input(kind, max(1, size // arity), rng) for _ in range(arity)]
+
+
+def _time_calls(function, other, kind, size, arity, min_time, max_calls, min_calls=MIN_SCALING_CALLS,
+                deadline=None):
+    """
+    Time calls of a function, and of the other version's function, at one size.
+
+    Calls of the two versions alternate on equal inputs, so drift hits both
+    alike. The results of the first call of each version are compared.
+
+    Returns:
+        dict: samples, other_samples, peak_alloc_bytes, other_peak_alloc_bytes
+        and results_match (the other values are None without another
+        version), or None when the deadline passed first.
+    """
+    versions = [(function, [])] + ([(other, [])] if other else [])
+    results = []
+    total = 0.0
+    call = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        while call < min_calls or (total < min_time and call < max_calls):
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            order = versions if call % 2 == 0 else versions[::-1]
+            for version, timings in order:
+                arguments = _arguments(kind, size, arity, f"{size}:{call}")
+                start_time = time.perf_counter()
+                result = version(*arguments)
+                elapsed = time.perf_counter() - start_time
+                timings.append(elapsed)
+                total += elapsed
+                if call == 0:
+                    results.append(result)
+            call += 1
+        peaks = []
+        for version, _ in versions:
+            tracemalloc.start()
+            version(*_arguments(kind, size, arity, f"{size}:{call}"))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peaks.append(peak)
+    if other is None:
+        return {"samples": versions[0][1], "other_samples": None, "peak_alloc_bytes": peaks[0],
+                "other_peak_alloc_bytes": None, "results_match": None}
+    return {"samples": versions[0][1], "other_samples": versions[1][1], "peak_alloc_bytes": peaks[0],
+            "other_peak_alloc_bytes": peaks[1], "results_match": _same_result(*results)}
+
+
+def _same_result(first, second):
+    try:
+        return bool(first == second)
+    except Exception:  # e.g. numpy arrays, compare their text instead
+        return repr(first) == repr(second)
+
+
+def _sanity_check(function, other, kind, sizes, arity):
+    """
+    Check that a function accepts this input kind and that both versions agree.
+
+    Returns:
+        dict: The checks, or None when the function rejects the input kind.
+    """
+    checks = {"results_match": None}
+    for size in sizes[:2]:
+        arguments = _arguments(kind, size, arity, f"{size}:check")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = function(*arguments)
+        except Exception:  # wrong input kind for this function
+            return None
+        if other is None:
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                other_result = other(*_arguments(kind, size, arity, f"{size}:check"))
+        except Exception as e:
+            checks.update(results_match=False, mismatch=f"size {size}: other version raised {e!r}")
+            return checks
+        if not _same_result(result, other_result):
+            checks.update(results_match=False, mismatch=f"size {size}: results differ")
+            return checks
+        checks["results_match"] = True
+    return checks
+
+
+def _scaling_worker(code_file, other_file, function_name, kind, sizes, time_budget=SCALING_TIME_BUDGET,
+                    call_budget=SCALING_CALL_BUDGET, min_time=0.05, max_calls=200):
+    """
+    Sandboxed side of profile_scaling: prints one JSON line per event.
+
+    The first line names the function and input kind that were picked, with
+    the result of their sanity checks, then one line per size follows. Sizes
+    stop growing once the slower version's next median call would take longer
+    than call_budget, or once time_budget is spent. Lines are flushed as they
+    are produced so the parent keeps everything measured before a timeout.
+    """
+    module = _load_module(code_file)
+    other_module = _load_module(other_file, "benchmarked_other") if other_file else None
+    candidates = [
+        (name, function, arity) for name, function, arity in _candidate_functions(module)
+        if function_name in (None, name)
+        and (other_module is None or inspect.isfunction(getattr(other_module, name, None)))
+    ]
+    kinds = [kind] if kind else INPUT_KINDS
+    chosen = None
+    for name, function, arity in candidates:
+        other = getattr(other_module, name) if other_module else None
+        for candidate_kind in kinds:
+            checks = _sanity_check(function, other, candidate_kind, sizes, arity)
+            if checks is not None:
+                chosen = (name, function, other, arity, candidate_kind, checks)
+                break
+        if chosen:
+            break
+    if chosen is None:
+        print(json.dumps({"error": "no benchmarkable function found"}), flush=True)
+        return
+    name, function, other, arity, chosen_kind, checks = chosen
+    print(json.dumps({"function": name, "kind": chosen_kind, "arity": arity, "checks": checks}), flush=True)
+    if checks["results_match"] is False:
+        return  # Timing two functions that compute different things proves nothing
+    deadline = time.perf_counter() + time_budget
+    previous = None
+    for size in sizes:
+        try:
+            measured = _time_calls(function, other, chosen_kind, size, arity, min_time, max_calls,
+                                   deadline=deadline)
+        except Exception as e:
+            print(json.dumps({"size": size, "error": repr(e)}), flush=True)
+            return
+        if measured is None:
+            return  # Out of time; the sizes measured so far make the profile
+        if measured["results_match"] is False:
+            print(json.dumps({"size": size, "mismatch": "results differ"}), flush=True)
+            return
+        print(json.dumps({"size": size, **measured}), flush=True)
+        slowest = max(statistics.median(samples) for samples in (measured["samples"], measured["other_samples"])
+                      if samples)
+        # Predict the next call from the growth since the last size, which catches exponential blowups
+        if slowest * max(1.0, slowest / previous if previous else 1.0) > call_budget:
+            return
+        previous = slowest
+
+
+def _scaling_worker_code(code_file, other_file, function_name, kind, sizes, time_budget):
+    """Code string running _scaling_worker as the __main__ module of a sandbox worker."""
+    arguments = (
+        os.path.abspath(code_file), other_file and os.path.abspath(other_file), function_name, kind,
+        list(sizes), time_budget,
+    )
+    return (
+        "import sys\n"
+        f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+        "import benchmark\n"
+        f"benchmark._scaling_worker{arguments!r}\n"
+    )
+
+
+@traced("benchmark.scaling")
+def profile_scaling(code_file, other_file=None, function_name=None, kind=None, sizes=DEFAULT_SIZES,
+                    time_budget=SCALING_TIME_BUDGET, sandbox=None):
+    """
+    Time one function of a generated file at growing input sizes.
+
+    Runs in a sandbox worker, under its CPU and memory limits, so runaway
+    code cannot hang or exhaust the caller; sizes not reached within the time
+    budget are simply missing from the result. With other_file, the same
+    function of the other file is timed alongside, call for call on the same
+    inputs, and both must return the same results.
+
+    Args:
+        sandbox (SandboxPool): Pool to run in (defaults to a one-worker pool for this call).
+
+    Returns:
+        dict: function, kind, checks, points ({size: median seconds}) and
+        samples ({size: [seconds]}), plus other_points and other_samples for
+        other_file, timed_out and error (None when the profile ran cleanly).
+    """
+    code = _scaling_worker_code(code_file, other_file, function_name, kind, sizes, time_budget)
+    settings = {
+        "timeout": time_budget + SCALING_STARTUP_TIME,
+        "cwd": os.path.dirname(os.path.abspath(code_file)),
+        "filename": "scaling_worker.py",
+    }
+    if sandbox is None:
+        with SandboxPool(size=1) as pool:
+            result = pool.run(code, **settings)
+    else:
+        result = sandbox.run(code, **settings)
+
+    profile = {
+        "function": None, "kind": None, "checks": None, "points": {}, "samples": {},
+        "other_points": {}, "other_samples": {}, "timed_out": result["timed_out"], "error": None,
+    }
+    for line in result["stdout"].splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if "function" in event:
+            profile.update(function=event["function"], kind=event["kind"], checks=event["checks"])
+        elif "samples" in event:
+            size = event["size"]
+            profile["samples"][size] = event["samples"]
+            profile["points"][size] = statistics.median(event["samples"])
+            if event["other_samples"]:
+                profile["other_samples"][size] = event["other_samples"]
+                profile["other_points"][size] = statistics.median(event["other_samples"])
+        elif "mismatch" in event:
+            profile["checks"] = {"results_match": False, "mismatch": f"size {event['size']}: {event['mismatch']}"}
+        elif "error" in event:
+            profile["error"] = event["error"]
+    if result["returncode"] and not result["timed_out"] and profile["error"] is None:
+        # Killed by a limit or crashed outside the timed calls, e.g. MemoryError under RLIMIT_AS
+        lines = result["stderr"].strip().splitlines()
+        profile["error"] = lines[-1] if lines else f"exit code {result['returncode']}"
+    return profile
+
+
+def growth_exponent(points):
+    """Least-squares slope of log(time) against log(size): ~1 for O(n), ~2 for O(n^2)."""
+    pairs = [(math.log(size), math.log(seconds)) for size, seconds in points.items() if seconds > 0]
+    if len(pairs) < 2:
+        return None
+    mean_x = statistics.mean(x for x, _ in pairs)
+    mean_y = statistics.mean(y for _, y in pairs)
+    denominator = sum((x - mean_x) ** 2 for x, _ in pairs)
+    if denominator == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in pairs) / denominator
+
+
+def compare_scaling(profile, confidence=0.95, min_improvement=0.02):
+    """
+    Compare the two versions timed by profile_scaling(old_file, new_file).
+
+    Every common size gets a bootstrap interval of the relative change of the
+    median call time. The candidate only wins (or loses) when the interval
+    lies beyond min_improvement at each of the SCALING_DECIDING_SIZES largest
+    common sizes, and never when the two versions return different results.
+    """
+    common = sorted(set(profile["samples"]) & set(profile["other_samples"]))
+    result = {
+        "function": profile["function"],
+        "results_match": (profile["checks"] or {}).get("results_match"),
+        "old_exponent": growth_exponent(profile["points"]),
+        "new_exponent": growth_exponent(profile["other_points"]),
+        "largest_common_size": common[-1] if common else None,
+        "sizes": {
+            size: compare_samples(profile["samples"][size], profile["other_samples"][size],
+                                  confidence, min_improvement)
+            for size in common
+        },
+        "faster": False,
+        "slower": False,
+    }
+    deciding = common[-SCALING_DECIDING_SIZES:]
+    if result["results_match"] is False or len(deciding) < 2:
+        return result
+    result["faster"] = all(result["sizes"][size]["faster"] for size in deciding)
+    result["slower"] = all(result["sizes"][size]["slower"] for size in deciding)
+    return result
+
+
+def _sandbox_runner(sandbox, code_file):
+    """run_once callable executing a file's code in a warm sandbox worker."""
+    with open(code_file, "r", encoding="utf-8") as file:
+        code = file.read()
+    directory = os.path.dirname(os.path.abspath(code_file))
+    name = os.path.basename(code_file)
+    return lambda: sandbox.run(code, cwd=directory, filename=name)
+
+
+@traced("benchmark")
+def compare_programs(old_file, new_file, warmup=1, repeats=7, confidence=0.95,
+                     min_improvement=0.02, scaling=True, sizes=DEFAULT_SIZES, sandbox=None):
+    """
+    Benchmark a candidate file against a baseline file.
+
+    Args:
+        old_file (str): The baseline program.
+        new_file (str): The candidate program.
+        warmup (int): Discarded runs per program.
+        repeats (int): Measured runs per program.
+        confidence (float): Confidence level of the median comparison.
+        min_improvement (float): Smallest relative speedup that counts.
+        scaling (bool): Also profile a shared function at growing input sizes.
+        sizes (tuple): Input sizes for the scaling profile.
+        sandbox (SandboxPool): Run the programs in warm sandbox workers instead of
+            fresh interpreters, which keeps interpreter startup out of the timings.
+
+    Returns:
+        dict: The full report; report["accept"] says whether to keep the candidate.
+    """
+    report = {
+        "settings": {
+            "warmup": warmup, "repeats": repeats, "confidence": confidence,
+            "min_improvement": min_improvement, "sizes": list(sizes),
+            "runner": "subprocess" if sandbox is None else "sandbox",
+        },
+    }
+    if sandbox is not None:
+        old_run, new_run = _sandbox_runner(sandbox, old_file), _sandbox_runner(sandbox, new_file)
+    else:
+        old_run, new_run = (lambda: run_script_once(old_file)), (lambda: run_script_once(new_file))
+    old_samples, new_samples = measure(old_run, new_run, warmup, repeats)
+    report["old"] = summarize(old_samples)
+    report["new"] = summarize(new_samples)
+    report["program"] = compare_samples(
+        [sample["wall"] for sample in old_samples],
+        [sample["wall"] for sample in new_samples],
+        confidence, min_improvement,
+    )
+
+    report["scaling"] = None
+    if scaling:
+        profile = profile_scaling(old_file, new_file, sizes=sizes, sandbox=sandbox)
+        # The profile is kept even without a function to compare, for its timed_out and error
+        report["scaling"] = {
+            "profile": profile,
+            "comparison": compare_scaling(profile, confidence, min_improvement) if profile["function"] else None,
+        }
+
+    scaling_result = (report["scaling"] or {}).get("comparison") or {}
+    report["accept"] = bool(
+        report["program"]["faster"]
+        or (scaling_result.get("faster") and not report["program"]["slower"])
+    )
+    return report
+
+
+def report_path(code_file):
+    """Path of the JSON report kept next to a code file."""
+    return os.path.splitext(code_file)[0] + "_benchmark.json"
+
+
+def write_report(report, path):
+    """Save a benchmark report as JSON."""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+
+def add_benchmark_arguments(parser):
+    """Add the benchmark command line options to an argparse parser."""
+    group = parser.add_argument_group("benchmark")
+    group.add_argument("--bench-warmup", type=int, default=1, help="discarded runs before measuring")
+    group.add_argument("--bench-repeats", type=int, default=7, help="measured runs per version")
+    group.add_argument("--bench-confidence", type=float, default=0.95, help="confidence level of the comparison")
+    group.add_argument("--bench-min-improvement", type=float, default=0.02,
+                       help="smallest relative speedup that counts, e.g. 0.02 for 2%%")
+    group.add_argument("--no-scaling", action="store_true", help="skip the in-process input size scaling profile")
+
+
+def benchmark_settings_from_args(args):
+    """Keyword arguments for compare_programs from parsed command line options."""
+    return {
+        "warmup": args.bench_warmup,
+        "repeats": args.bench_repeats,
+        "confidence": args.bench_confidence,
+        "min_improvement": args.bench_min_improvement,
+        "scaling": not args.no_scaling,
+    }
@@ -0,0 +1,201 @@
+"""
+Content-addressed on-disk cache for chat completion responses.
+
+Every response is stored under a hash of the model name plus the exact
+messages that produced it, so re-running a spec reuses the earlier answer
+instead of paying for another round trip. In replay mode the cache is the
+only source of responses and the network is never touched, which makes
+whole pipeline runs reproducible from recorded responses.
+"""
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_CACHE_DIR = ".spc_cache"
+
+
+class ReplayMiss(LookupError):
+    """Raised in replay mode when no recorded response exists for a request."""
+
+
+def cache_key(model, messages, **params):
+    """Return the hex digest identifying a request."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Directory of JSON files, one per request, keyed by cache_key.
+
+    Args:
+        directory (str): Where the entries live.
+        max_entries (int): Keep at most this many entries (None for no limit).
+        max_bytes (int): Keep the cache below this many bytes (None for no limit).
+        max_age (float): Entries older than this many seconds are dropped (None to keep forever).
+        bypass (bool): Skip lookups but still record fresh responses.
+        replay (bool): Serve only recorded responses and never call the model.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_entries=5000, max_bytes=200 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, bypass=False, replay=False):
+        if bypass and replay:
+            raise ValueError("bypass and replay cannot be used together")
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.bypass = bypass
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, model, messages, **params):
+        """
+        Look up a recorded response.
+
+        Returns:
+            str or None: The recorded content, or None on a miss.
+
+        Raises:
+            ReplayMiss: In replay mode, when nothing was recorded for the request.
+        """
+        key = cache_key(model, messages, **params)
+        if self.bypass:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            entry = None
+        # Recorded responses never expire in replay mode, the run depends on them
+        if entry is not None and not self.replay and self._expired(entry):
+            entry = None
+        if entry is None:
+            self.misses += 1
+            if self.replay:
+                raise ReplayMiss(f"No recorded response for request {key} in {self.directory}")
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)  # Refresh the mtime so eviction is least-recently-used
+        except OSError:
+            pass
+        return entry["content"]
+
+    def put(self, model, messages, content, **params):
+        """Record a response and evict old entries if the cache grew too big."""
+        key = cache_key(model, messages, **params)
+        entry = {
+            "model": model,
+            "messages": messages,
+            "params": params,
+            "content": content,
+            "created": time.time(),
+        }
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(temp_path, path)  # Atomic, so concurrent jobs never see half an entry
+        self.evict()
+
+    def fetch(self, model, messages, call, fresh=False, **params):
+        """
+        Return the cached content for a request, calling `call()` to fill a miss.
+
+        With `fresh`, the lookup is skipped (except in replay mode) and the new
+        response is recorded; retries use it to get a new sample instead of the
+        answer that already failed.
+        """
+        content = None if fresh and not self.replay else self.get(model, messages, **params)
+        if content is None:
+            content = call()
+            self.put(model, messages, content, **params)
+        return content
+
+    async def fetch_async(self, model, messages, call, fresh=False, **params):
+        """Async form of fetch: `call()` must return an awaitable."""
+        content = None if fresh and not self.replay else self.get(model, messages, **params)
+        if content is None:
+            content = await call()
+            self.put(model, messages, content, **params)
+        return content
+
+    def _expired(self, entry):
+        return self.max_age is not None and time.time() - entry.get("created", 0) > self.max_age
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones over the size limits."""
+        if self.replay:
+            return
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (
+            (self.max_entries is not None and len(entries) > self.max_entries)
+            or (self.max_bytes is not None and total_bytes > self.max_bytes)
+        ):
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total_bytes -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def add_cache_arguments(parser):
+    """Add the response cache command line options to an argparse parser."""
+    group = parser.add_argument_group("response cache")
+    group.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of cached model responses")
+    group.add_argument("--no-cache", action="store_true", help="do not read or write the response cache")
+    group.add_argument("--refresh-cache", action="store_true", help="ignore cached responses but record new ones")
+    group.add_argument("--replay", action="store_true", help="serve only recorded responses, never call the model")
+    group.add_argument("--cache-max-entries", type=int, default=5000, help="maximum number of cached responses")
+    group.add_argument("--cache-max-age", type=float, default=30.0, help="maximum age of a cached response, in days")
+
+
+def cache_from_args(args):
+    """Build the ResponseCache selected by parsed command line options, or None."""
+    if args.no_cache:
+        if args.replay:
+            raise SystemExit("--replay needs the cache, it cannot be combined with --no-cache")
+        return None
+    if args.replay and args.refresh_cache:
+        raise SystemExit("--replay and --refresh-cache cannot be combined")
+    return ResponseCache(
+        directory=args.cache_dir,
+        max_entries=args.cache_max_entries,
+        max_age=args.cache_max_age * 24 * 3600,
+        bypass=args.refresh_cache,
+        replay=args.replay,
+    )
@@ -0,0 +1,114 @@
+"""
+Long-lived pylint service.
+
+Shelling out to `pylint` pays the interpreter startup, the pylint/astroid
+imports and the stdlib inference from scratch on every call. The service
+keeps pylint loaded in this process, lints code strings directly and caches
+the result of every code string it has seen, so repeated lint passes in the
+lint loop or across batch jobs cost one in-process run at most.
+
+Results are structured: a numeric score plus a list of LintMessage tuples.
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+LintMessage = collections.namedtuple("LintMessage", "msg_id symbol line column message")
+
+
+class LintResult(collections.namedtuple("LintResult", "score messages")):
+    """Score out of 10 and the messages pylint reported."""
+
+    __slots__ = ()
+
+    @property
+    def clean(self):
+        """True when pylint rated the code 10/10."""
+        return self.score >= 10.0
+
+    def text(self, filename="generatedcode.py"):
+        """Render the result like pylint's text report, for prompts and printing."""
+        lines = [
+            f"{filename}:{message.line}:{message.column}: {message.msg_id}: "
+            f"{message.message} ({message.symbol})"
+            for message in self.messages
+        ]
+        lines.append(f"Your code has been rated at {self.score:.2f}/10")
+        return "\n".join(lines)
+
+
+class LintService:
+    """
+    Lint code strings with an in-process pylint, caching results by content hash.
+
+    pylint is not thread safe, so runs are serialized with a lock; cache hits
+    do not wait for it.
+
+    Args:
+        pylint_args (list): Extra pylint command line options.
+        max_entries (int): Number of results kept in the cache.
+    """
+
+    def __init__(self, pylint_args=(), max_entries=512):
+        self.pylint_args = list(pylint_args)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._directory = tempfile.mkdtemp(prefix="spc_lint_")
+
+    def _key(self, code, filename):
+        payload = "\0".join([filename, *self.pylint_args, code])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lint(self, code, filename="generatedcode.py"):
+        """
+        Lint a code string as if it were saved as `filename`.
+
+        Returns:
+            LintResult: The score and messages.
+        """
+        key = self._key(code, filename)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        with self._run_lock:
+            result = self._run_pylint(code, filename)
+
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def _run_pylint(self, code, filename):
+        # Imported here so that merely importing the module stays cheap
+        from astroid import MANAGER
+        from pylint.lint import Run
+        from pylint.reporters import CollectingReporter
+
+        path = os.path.join(self._directory, filename)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(code)
+        # astroid caches modules by name; drop the previous code so it is re-parsed
+        MANAGER.astroid_cache.pop(os.path.splitext(filename)[0], None)
+
+        reporter = CollectingReporter()
+        run = Run([*self.pylint_args, "--persistent=n", "--score=y", path], reporter=reporter, exit=False)
+        stats = run.linter.stats
+        score = getattr(stats, "global_note", None)
+        if score is None and isinstance(stats, dict):  # pylint < 2.12
+            score = stats.get("global_note")
+        messages = [
+            LintMessage(message.msg_id, message.symbol, message.line, message.column, message.msg)
+            for message in reporter.messages
+        ]
+        return LintResult(float(score or 0.0), messages)
@@ -0,0 +1,301 @@
+"""
+Pool of pre-warmed worker processes that execute generated code.
+
+Starting a fresh interpreter for every test run costs interpreter startup
+plus the stdlib imports of the generated program. Instead, a few worker
+processes are started once (through the multiprocessing forkserver, with
+the commonly used stdlib modules preloaded) and every submitted code string
+runs in a child forked from an idle worker. The fork is cheap, inherits the
+already imported modules, and keeps each run isolated: whatever the
+generated code does to the interpreter dies with the child.
+
+Each run gets a wall-clock timeout plus CPU time and address space rlimits,
+so one runaway program cannot hang or starve the tool.
+
+On platforms without fork (Windows) the pool falls back to one subprocess
+per run, still with the timeout.
+"""
+import atexit
+import linecache
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PRELOAD_MODULES = [
+    "collections", "dataclasses", "functools", "heapq", "itertools", "json", "math",
+    "random", "re", "string", "typing", "unittest", "unittest.mock",
+]
+CAN_FORK = hasattr(os, "fork") and resource is not None
+
+
+def _result(stdout, stderr, returncode, timed_out, wall, cpu=None, max_rss_kb=None):
+    """Execution result, shaped like benchmark.run_script_once samples."""
+    return {
+        "stdout": stdout,
+        "stderr": stderr,
+        "returncode": returncode,
+        "timed_out": timed_out,
+        "wall": wall,
+        "cpu": cpu,
+        "max_rss_kb": max_rss_kb,
+    }
+
+
+def _execute_child(code, filename, cwd, cpu_seconds, memory_mb, stdout_fd, stderr_fd):
+    """Body of the forked child: apply limits, run the code as __main__ and exit."""
+    status = 0
+    try:
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        if memory_mb:
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if cwd:
+            os.chdir(cwd)
+        path = os.path.join(os.getcwd(), filename)
+        # A real module object, so unittest.main() finds the tests in sys.modules["__main__"]
+        module = types.ModuleType("__main__")
+        module.__file__ = path
+        sys.modules["__main__"] = module
+        sys.argv = [path]
+        # Tracebacks read their source lines through linecache: serve them from the code that runs,
+        # not from whatever file is on disk under that name
+        linecache.cache[path] = (len(code), None, code.splitlines(keepends=True), path)
+        exec(compile(code, path, "exec"), module.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def _wait_child(pid, timeout):
+    """Wait for a forked child, killing it after `timeout` seconds."""
+    deadline = time.monotonic() + timeout if timeout else None
+    pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+    timed_out = False
+    try:
+        while True:
+            waited_pid, status, usage = os.wait4(pid, os.WNOHANG)
+            if waited_pid:
+                return status, usage, timed_out
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                os.kill(pid, signal.SIGKILL)
+                timed_out = True
+                _, status, usage = os.wait4(pid, 0)
+                return status, usage, timed_out
+            if pidfd is not None:
+                select.select([pidfd], [], [], remaining)
+            else:
+                time.sleep(min(0.005, remaining) if remaining is not None else 0.005)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def _worker_loop(connection):
+    """Main loop of a worker process: fork a child per request and report back."""
+    for module in PRELOAD_MODULES:
+        __import__(module)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        code, filename, cwd, timeout, cpu_seconds, memory_mb = request
+        with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+            start_time = time.perf_counter()
+            pid = os.fork()
+            if pid == 0:
+                connection.close()
+                _execute_child(code, filename, cwd, cpu_seconds, memory_mb,
+                               stdout_file.fileno(), stderr_file.fileno())
+            status, usage, timed_out = _wait_child(pid, timeout)
+            wall = time.perf_counter() - start_time
+            stdout_file.seek(0)
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode("utf-8", errors="replace")
+            returncode = os.waitstatus_to_exitcode(status)
+            if timed_out:
+                stderr += f"\nTimeoutError: execution exceeded {timeout}s and was killed\n"
+            elif returncode == -signal.SIGXCPU:
+                stderr += f"\nTimeoutError: execution exceeded its CPU time limit of {cpu_seconds}s\n"
+            max_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+            connection.send(_result(
+                stdout_file.read().decode("utf-8", errors="replace"),
+                stderr,
+                returncode,
+                timed_out,
+                wall,
+                usage.ru_utime + usage.ru_stime,
+                max_rss_kb,
+            ))
+
+
+class _Worker:
+    """Handle on one warm worker process."""
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def run(self, request):
+        self.connection.send(request)
+        return self.connection.recv()
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.connection.close()
+
+
+class SandboxPool:
+    """
+    Pool of warm workers executing code strings.
+
+    Args:
+        size (int): Number of worker processes (defaults to the CPU count).
+        timeout (float): Default wall-clock limit per run, in seconds.
+        cpu_seconds (int): CPU time rlimit per run (defaults to the timeout, rounded up).
+        memory_mb (int): Address space rlimit per run, in MiB (None for no limit).
+    """
+
+    def __init__(self, size=None, timeout=10.0, cpu_seconds=None, memory_mb=1024):
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self._idle = queue.Queue()
+        self._workers = []
+        self._closed = False
+        if CAN_FORK:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOAD_MODULES)
+            self._context = context
+            for _ in range(self.size):
+                worker = _Worker(context)
+                self._workers.append(worker)
+                self._idle.put(worker)
+
+    def run(self, code, timeout=None, cwd=None, filename="generatedcode.py"):
+        """
+        Execute a code string as the __main__ module of a fresh child.
+
+        Blocks until a worker is free, so it can be called from many threads.
+
+        Args:
+            code (str): Python source to run.
+            timeout (float): Wall-clock limit in seconds (defaults to the pool's).
+            cwd (str): Working directory of the run.
+            filename (str): Name the code runs under (__file__, sys.argv[0], tracebacks).
+
+        Returns:
+            dict: stdout, stderr, returncode, timed_out, wall, cpu and max_rss_kb.
+        """
+        if self._closed:
+            raise RuntimeError("SandboxPool is closed")
+        timeout = timeout or self.timeout
+        cpu_seconds = self.cpu_seconds or int(timeout) + 1
+        if not CAN_FORK:
+            return self._run_in_subprocess(code, timeout, cwd, filename)
+
+        worker = self._idle.get()
+        start_time = time.perf_counter()
+        try:
+            return worker.run((code, filename, cwd, timeout, cpu_seconds, self.memory_mb))
+        except (EOFError, OSError) as error:
+            # The worker itself died; replace it so the pool keeps its size and report a failed run
+            worker.close()
+            self._workers.remove(worker)
+            worker = _Worker(self._context)
+            self._workers.append(worker)
+            return _result("", f"Sandbox worker died: {error!r}\n", -signal.SIGKILL, False,
+                           time.perf_counter() - start_time)
+        finally:
+            self._idle.put(worker)
+
+    def _run_in_subprocess(self, code, timeout, cwd, filename):
+        """Fallback without fork: write the code to a temp file and run a fresh interpreter."""
+        directory = cwd or os.getcwd()
+        handle, path = tempfile.mkstemp(suffix="_" + filename, dir=directory)
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            file.write(code)
+        start_time = time.perf_counter()
+        try:
+            completed = subprocess.run(
+                [sys.executable, path], cwd=directory, capture_output=True, text=True, timeout=timeout
+            )
+            return _result(completed.stdout, completed.stderr, completed.returncode, False,
+                           time.perf_counter() - start_time)
+        except subprocess.TimeoutExpired as e:
+            stdout = e.stdout.decode("utf-8", errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+            return _result(stdout, f"TimeoutError: execution exceeded {timeout}s and was killed\n",
+                           -getattr(signal, "SIGKILL", 9), True, time.perf_counter() - start_time)
+        finally:
+            os.remove(path)
+
+    def close(self):
+        """Stop every worker."""
+        self._closed = True
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_sandbox_arguments(parser):
+    """Add the execution sandbox command line options to an argparse parser."""
+    group = parser.add_argument_group("execution sandbox")
+    group.add_argument("--workers", type=int, default=None, help="number of warm execution workers (default: CPU count)")
+    group.add_argument("--run-timeout", type=float, default=10.0, help="wall-clock limit per program run, in seconds")
+    group.add_argument("--memory-mb", type=int, default=1024, help="address space limit per program run, in MiB")
+    group.add_argument("--test-timeout", type=float, default=5.0, help="wall-clock limit per test case, in seconds")
+
+
+def sandbox_from_args(args):
+    """Build the SandboxPool selected by parsed command line options; it is closed at exit."""
+    pool = SandboxPool(size=args.workers, timeout=args.run_timeout, memory_mb=args.memory_mb)
+    atexit.register(pool.close)
+    return pool
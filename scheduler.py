@@ -0,0 +1,370 @@
+"""
+Rate-limit aware scheduler for every model call.
+
+The API enforces requests-per-minute and tokens-per-minute limits. Sending as
+fast as possible runs into 429s, and backing off blindly leaves the budget
+idle. Instead, every model call goes through one RequestScheduler:
+
+* two token buckets (requests and tokens per minute) refill continuously; a
+  call waits until both can cover it, with its prompt tokens estimated
+  before sending (tiktoken when installed, ~4 characters per token
+  otherwise) and corrected with the real usage afterwards;
+* waiting calls are admitted by stage priority, lint before optimize before
+  generate, so jobs that are almost done finish first; every call the budget
+  covers is admitted at once and its waiter woken up;
+* a 429, 5xx or connection error is retried with jittered exponential
+  backoff, honouring the server's Retry-After, and a 429 pauses every call,
+  not only the one that got it;
+* the OpenAI clients share a pooled keep-alive httpx client and have their
+  own retries disabled, so the scheduler is the only place that retries.
+
+The scheduler is thread safe and serves both the threaded (sync) and asyncio
+(batch) callers. Point --base-url at stub_server.py to exercise it locally.
+"""
+import asyncio
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, OpenAI
+
+from tracing import annotate
+
+try:
+    import tiktoken
+except ImportError:  # Optional, prompt tokens are then estimated from the length
+    tiktoken = None
+
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_MAX_CONNECTIONS = 20
+BURST_SECONDS = 6.0  # The buckets hold this many seconds of budget, the API enforces limits over short windows
+COMPLETION_TOKENS = 1024  # Reserved per candidate answer until the real usage is known
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+MAX_RETRY_AFTER = 120.0
+MAX_POLL = 0.25
+KEEPALIVE_SECONDS = 30.0
+CONNECT_TIMEOUT = 10.0
+REQUEST_TIMEOUT = 120.0
+STAGE_PRIORITIES = {"lint": 0, "optimize": 1, "generate": 2}
+
+_encodings = {}
+
+
+def estimate_tokens(messages, model=None):
+    """Estimate the prompt tokens of chat messages, with tiktoken when it is available."""
+    text = "".join(message["content"] for message in messages)
+    overhead = 4 * len(messages)  # Role and separators of every message
+    if tiktoken is not None and _encodings.get(model) is not False:
+        try:
+            if model not in _encodings:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+            return len(_encodings[model].encode(text)) + overhead
+        except Exception:  # e.g. the encoding cannot be downloaded, stop trying
+            _encodings[model] = False
+    return len(text) // 4 + overhead
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget of `per_minute` units.
+
+    The bucket holds BURST_SECONDS worth of budget. A request larger than that
+    is let through once the bucket is full and leaves it in debt.
+    """
+
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (0 when it can be taken now)."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount):
+        """Remove budget; a negative amount gives budget back."""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RequestScheduler:
+    """
+    Admit model calls within the RPM/TPM budget, by priority, and retry transient errors.
+
+    Args:
+        rpm (int): Requests per minute (0 or None for no limit).
+        tpm (int): Tokens per minute (0 or None for no limit).
+        max_retries (int): Retries of a call after a 429, 5xx or connection error.
+        base_url (str): API base URL, e.g. of a local stub server (None for the default).
+        max_connections (int): Size of the keep-alive connection pool of the clients.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_retries=DEFAULT_MAX_RETRIES, base_url=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._waiting = []  # Heap of (priority, sequence) tickets
+        self._pending = {}  # Waiting ticket -> (tokens, function waking its caller)
+        self._admitted = {}  # Admitted ticket whose caller has not noticed yet -> tokens
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=KEEPALIVE_SECONDS,
+        )
+
+    def openai_client(self, api_key):
+        """An OpenAI client on a pooled keep-alive connection, retries left to the scheduler."""
+        http_client = httpx.Client(limits=self._limits(), timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT))
+        return OpenAI(api_key=api_key, base_url=self.base_url, max_retries=0, http_client=http_client)
+
+    def async_openai_client(self, api_key):
+        """AsyncOpenAI counterpart of openai_client."""
+        http_client = httpx.AsyncClient(limits=self._limits(), timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT))
+        return AsyncOpenAI(api_key=api_key, base_url=self.base_url, max_retries=0, http_client=http_client)
+
+    def _enqueue(self, stage, tokens, wake):
+        ticket = (STAGE_PRIORITIES.get(stage, len(STAGE_PRIORITIES)), next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+            self._pending[ticket] = (tokens, wake)
+        return ticket
+
+    def _discard(self, ticket):
+        with self._lock:
+            if ticket in self._admitted:
+                # Admitted, but the caller gave up before sending: give the budget back
+                tokens = self._admitted.pop(ticket)
+                if self.requests:
+                    self.requests.take(-1)
+                if self.tokens:
+                    self.tokens.take(-tokens)
+            elif ticket in self._pending:
+                del self._pending[ticket]
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+            self._admit_affordable()
+
+    def _admit_affordable(self):
+        """Admit waiting calls in priority order while the budget covers them; returns the wait of the next one."""
+        while self._waiting:
+            ticket = self._waiting[0]
+            tokens, wake = self._pending[ticket]
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now) if self.requests else 0.0,
+                self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+            )
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiting)
+            del self._pending[ticket]
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self._admitted[ticket] = tokens
+            wake()
+        return 0.0
+
+    def _admit(self, ticket):
+        """Admit what the budget covers; returns 0 once this call is admitted, else the seconds to wait at most."""
+        with self._lock:
+            wait = self._admit_affordable()
+            if ticket in self._admitted:
+                del self._admitted[ticket]
+                return 0.0
+            return min(wait, MAX_POLL)
+
+    def acquire(self, stage, tokens):
+        """Block until a call of this stage may be sent; returns the seconds waited."""
+        start_time = time.monotonic()
+        admitted = threading.Event()
+        ticket = self._enqueue(stage, tokens, admitted.set)
+        try:
+            while True:
+                wait = self._admit(ticket)
+                if not wait:
+                    return time.monotonic() - start_time
+                admitted.wait(wait)
+        except BaseException:
+            self._discard(ticket)
+            raise
+
+    async def acquire_async(self, stage, tokens):
+        """Async counterpart of acquire; a cancelled call leaves the queue."""
+        start_time = time.monotonic()
+        loop = asyncio.get_running_loop()
+        admitted = asyncio.Event()
+        ticket = self._enqueue(stage, tokens, lambda: loop.call_soon_threadsafe(admitted.set))
+        try:
+            while True:
+                wait = self._admit(ticket)
+                if not wait:
+                    return time.monotonic() - start_time
+                try:
+                    await asyncio.wait_for(admitted.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._discard(ticket)
+            raise
+
+    def summary(self):
+        """One line on the retries of the run, for the end of its output."""
+        return f"Model call retries: {self.retries} ({self.throttled} after a 429)"
+
+    def _settle(self, reserved, usage):
+        """Correct the token budget once a call is over: False refunds it, unknown usage keeps the reservation."""
+        if not self.tokens:
+            return
+        if usage is False:
+            used = 0
+        else:
+            used = getattr(usage, "total_tokens", None)
+            if used is None and isinstance(usage, dict):
+                used = usage.get("total_tokens")
+            if used is None:
+                used = reserved
+        with self._lock:
+            self.tokens.take(used - reserved)
+            self._admit_affordable()  # A refund may cover waiting calls
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying a failed call, or None when it must not be retried."""
+        status = getattr(error, "status_code", None)
+        retryable = status == 429 or (status is not None and status >= 500) \
+            or (status is None and isinstance(error, APIConnectionError))
+        if not retryable or attempt >= self.max_retries:
+            return None
+        self.retries += 1
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))  # Full jitter
+        else:
+            delay += random.uniform(0, min(1.0, delay * 0.1))  # Do not all come back at once
+        if status == 429:
+            # The limit is shared, so every waiting call backs off, not only this one
+            self.throttled += 1
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, request, messages, stage="generate", n=1, model=None, usage_of=None):
+        """
+        Send a model call within the budget, retrying transient errors.
+
+        Args:
+            request (callable): Makes the call and returns its result.
+            messages (list): The chat messages, to estimate the prompt tokens.
+            stage (str): Pipeline stage, for the priority.
+            n (int): Candidate answers requested, for the completion token reservation.
+            model (str): Model name, for the token estimate.
+            usage_of (callable): Takes the result and returns its token usage.
+
+        Returns:
+            The result of request().
+        """
+        reserved = estimate_tokens(messages, model) + COMPLETION_TOKENS * n
+        waited = 0.0
+        for attempt in itertools.count():
+            waited += self.acquire(stage, reserved)
+            try:
+                result = request()
+            except Exception as e:
+                self._settle(reserved, False)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._settle(reserved, usage_of(result) if usage_of else None)
+            annotate(queue_wait=waited, retries=attempt)
+            return result
+
+    async def call_async(self, request, messages, stage="generate", n=1, model=None, usage_of=None):
+        """Async counterpart of call; request is a coroutine function."""
+        reserved = estimate_tokens(messages, model) + COMPLETION_TOKENS * n
+        waited = 0.0
+        for attempt in itertools.count():
+            waited += await self.acquire_async(stage, reserved)
+            try:
+                result = await request()
+            except Exception as e:
+                self._settle(reserved, False)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._settle(reserved, usage_of(result) if usage_of else None)
+            annotate(queue_wait=waited, retries=attempt)
+            return result
+
+
+def retry_after(error):
+    """Seconds the server asked to wait in the Retry-After(-ms) headers of an error, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return min(MAX_RETRY_AFTER, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(value)))
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            return min(MAX_RETRY_AFTER, max(0.0, date.timestamp() - time.time()))
+    except (TypeError, ValueError):
+        return None
+
+
+def add_scheduler_arguments(parser):
+    """Add the request scheduling command line options to an argparse parser."""
+    group = parser.add_argument_group("request scheduling")
+    group.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="requests per minute allowed (0 for no limit)")
+    group.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="tokens per minute allowed (0 for no limit)")
+    group.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                       help="retries of a model call after a 429, 5xx or connection error")
+    group.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                       help="keep-alive connections kept open to the API")
+    group.add_argument("--base-url", default=None, help="API base URL, e.g. http://127.0.0.1:8765/v1 for stub_server.py")
+
+
+def scheduler_from_args(args):
+    """Build the RequestScheduler selected by parsed command line options."""
+    return RequestScheduler(
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_retries=args.max_retries,
+        base_url=args.base_url,
+        max_connections=args.max_connections,
+    )
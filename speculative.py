@@ -0,0 +1,129 @@
+"""
+Speculative evaluation of several model candidates.
+
+Instead of one answer per model round trip, a stage can sample N candidate
+answers at once and check them concurrently. race() returns as soon as one
+candidate is good enough; when none is, the best scoring candidate is kept so
+the stage can carry on from it. A check that raises counts as the worst
+candidate; the race only raises when every check did.
+
+Once a race is decided the other checks are cancelled: they call
+raise_if_cancelled() before each test run or lint pass and stop there, and
+the race waits for them, so no loser still holds a sandbox worker or the lint
+lock when the stage moves on (e.g. to benchmarking).
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+# Decision events of the races the current check belongs to, innermost last
+_race_events = contextvars.ContextVar("race_events", default=())
+
+
+class Cancelled(Exception):
+    """Raised inside a check whose race was already decided."""
+
+    outcome = "cancelled"  # Outcome of the spans it leaves, see Tracer.span
+
+
+def raise_if_cancelled():
+    """Stop the current check, by raising Cancelled, if a race it belongs to was decided."""
+    if any(event.is_set() for event in _race_events.get()):
+        raise Cancelled("the race was decided by another candidate")
+
+
+def _run_check(event, check, candidate):
+    _race_events.set(_race_events.get() + (event,))
+    return check(candidate)
+
+
+def check_all(check, candidates):
+    """Check every candidate concurrently and return the results in candidate order."""
+    if len(candidates) == 1:
+        return [check(candidates[0])]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, check, candidate)
+            for candidate in candidates
+        ]
+        return [future.result() for future in futures]
+
+
+def race(check, candidates, accept, score):
+    """
+    Check candidates concurrently and return the first accepted result.
+
+    Args:
+        check (callable): Takes a candidate and returns its result.
+        candidates (list): The candidates to check.
+        accept (callable): Takes a result, True when it is good enough to stop.
+        score (callable): Takes a result, higher is better.
+
+    Returns:
+        The first accepted result, or the best scoring one when none is accepted.
+
+    Raises:
+        Exception: The error of the first failed check, when every check failed.
+    """
+    if len(candidates) == 1:
+        return check(candidates[0])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates))
+    decided = threading.Event()
+    best = None
+    errors = []
+    try:
+        # Each check runs in a copy of the current context, so its spans nest under the caller's
+        futures = [
+            executor.submit(contextvars.copy_context().run, _run_check, decided, check, candidate)
+            for candidate in candidates
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # a broken candidate loses, it does not end the race
+                errors.append(e)
+                continue
+            if accept(result):
+                return result
+            if best is None or score(result) > score(best):
+                best = result
+    finally:
+        # The other checks stop at their next raise_if_cancelled(); wait until they have
+        decided.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    if errors and len(errors) == len(candidates):
+        raise errors[0]
+    return best
+
+
+async def _run_check_async(event, check, candidate):
+    _race_events.set(_race_events.get() + (event,))
+    return await check(candidate)
+
+
+async def race_async(check, candidates, accept, score):
+    """Async counterpart of race; check is a coroutine function."""
+    decided = threading.Event()
+    tasks = [asyncio.ensure_future(_run_check_async(decided, check, candidate)) for candidate in candidates]
+    best = None
+    errors = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Exception as e:  # a broken candidate loses, it does not end the race
+                errors.append(e)
+                continue
+            if accept(result):
+                return result
+            if best is None or score(result) > score(best):
+                best = result
+    finally:
+        # Cancelling the tasks would leave their sandbox runs going on in worker threads,
+        # so they stop at their next raise_if_cancelled() instead, and are waited for
+        decided.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if errors and len(errors) == len(candidates):
+        raise errors[0]
+    return best
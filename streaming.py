@@ -0,0 +1,357 @@
+"""
+Streaming completions with incremental validation.
+
+The model is asked for bare code but regularly answers with markdown fences,
+a sentence of prose first, or an explanation after the code. Instead of
+waiting for the whole completion, the answer is checked as it streams in:
+
+* a markdown fence switches to fenced mode: only the Python blocks are kept,
+  joined together (the code and its tests often come as two blocks with a
+  sentence in between), and the prose around them is not validated;
+* without fences, a line of prose after code that compiles ends the answer
+  right away (the stream is then only read to its end for the token usage
+  it reports last);
+* a short prose preamble is tolerated while waiting for the code, but an
+  answer that keeps being prose is aborted;
+* the code received so far is compiled every few lines, and the stream is
+  aborted as soon as it cannot become valid Python any more.
+
+An aborted stream is retried, and time-to-first-token and time-to-valid-code
+are recorded for every call.
+"""
+import codeop
+import keyword
+import time
+import warnings
+
+CHECK_EVERY_LINES = 5
+MAX_PREAMBLE_LINES = 3
+LANGUAGE_TAGS = {"python", "python3", "py"}
+
+
+class StreamAborted(Exception):
+    """Raised when a streamed answer is clearly not the code that was asked for."""
+
+
+def extract_code(text):
+    """
+    Return the code part of a model answer, without markdown fences.
+
+    Handles fenced blocks with or without a language tag (every Python block
+    is kept, in order), prose around the blocks, a lone opening or closing
+    fence, and no fence at all.
+    """
+    lines = text.splitlines()
+    fences = [index for index, line in enumerate(lines) if line.strip().startswith("```")]
+    if not fences:
+        body = lines
+    elif len(fences) >= 2:
+        # Fences alternate between opening and closing; an unclosed last block runs to the end
+        closings = fences[1::2] + [len(lines)]
+        blocks = [
+            lines[opening + 1:closing] for opening, closing in zip(fences[::2], closings)
+            if is_python_fence(lines[opening])
+        ] or [lines[fences[0] + 1:fences[1]]]
+        body = []
+        for block in blocks:
+            code = "\n".join(block).strip("\n")
+            if code.strip():
+                body += (["", ""] if body else []) + code.split("\n")
+    elif lines[fences[0]].strip() != "```" or not "".join(lines[:fences[0]]).strip():
+        body = lines[fences[0] + 1:]  # Opening fence only, the answer was cut after the code
+    else:
+        body = lines[:fences[0]]  # Closing fence only
+    while body and not body[0].strip():
+        body.pop(0)
+    if body and body[0].strip().lower() in LANGUAGE_TAGS:
+        body.pop(0)  # The tag of a fence whose backticks were lost
+    return "\n".join(body).strip() + "\n"
+
+
+def is_python_fence(line):
+    """True for an opening fence of a Python block, tagged as Python or not tagged."""
+    tag = line.strip()[3:].strip().lower()
+    return not tag or tag in LANGUAGE_TAGS
+
+
+def is_prose(line):
+    """True for a line that is neither Python nor the start of broken Python, e.g. "Here is the code:"."""
+    if classify(line.lstrip() + "\n") != "invalid":
+        return False
+    words = line.split()
+    first_word = words[0].rstrip(":(") if words else ""
+    if keyword.iskeyword(first_word) or keyword.issoftkeyword(first_word):
+        return False
+    return not line.lstrip().startswith(("@", "#"))
+
+
+def classify(source):
+    """Return "complete", "incomplete" or "invalid" for a piece of Python source."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # e.g. SyntaxWarning for invalid escapes
+        try:
+            compiled = codeop.compile_command(source, "<stream>", "exec")
+        except (SyntaxError, ValueError, OverflowError):
+            return "invalid"
+    return "incomplete" if compiled is None else "complete"
+
+
+class StreamValidator:
+    """
+    Incrementally validate a streamed code answer.
+
+    feed() takes the text deltas as they arrive and returns True once the
+    answer is known to be complete (prose following complete unfenced code
+    was seen); finish() validates what was received when the stream ends.
+    A fenced answer is only complete at the end of the stream, since another
+    Python block (e.g. the tests) may follow the first one.
+
+    Args:
+        check_every (int): Compile the code received so far every this many lines.
+        max_preamble_lines (int): Prose lines tolerated before the code starts.
+    """
+
+    def __init__(self, check_every=CHECK_EVERY_LINES, max_preamble_lines=MAX_PREAMBLE_LINES):
+        self.check_every = check_every
+        self.max_preamble_lines = max_preamble_lines
+        self.text = ""
+        # None until the code starts, then "plain", or "fenced" inside a Python block, "between"
+        # blocks and "other" inside a block in another language
+        self.mode = None
+        self.done = False
+        self._code_lines = []
+        self._pending = ""
+        self._preamble_lines = 0
+        self._unchecked_lines = 0
+
+    @property
+    def code(self):
+        """The code received so far."""
+        return "\n".join(self._code_lines).strip() + "\n"
+
+    def feed(self, delta):
+        """
+        Add a text delta.
+
+        Returns:
+            bool: True when the answer is complete and the rest of the stream can be dropped.
+
+        Raises:
+            StreamAborted: When the answer is prose or can no longer become valid Python.
+        """
+        self.text += delta
+        self._pending += delta
+        while "\n" in self._pending and not self.done:
+            line, self._pending = self._pending.split("\n", 1)
+            self._add_line(line)
+        return self.done
+
+    def finish(self):
+        """
+        Validate the whole answer once the stream has ended.
+
+        Returns:
+            str: The code, without fences.
+
+        Raises:
+            StreamAborted: When no code or no valid code was received.
+        """
+        if self._pending and not self.done:
+            self._add_line(self._pending)
+            self._pending = ""
+        if self.mode is None or not "".join(self._code_lines).strip():
+            raise StreamAborted("the answer contains no code")
+        if classify(self.code) != "complete":
+            raise StreamAborted("the code is incomplete or does not compile")
+        return self.code
+
+    def _add_line(self, line):
+        stripped = line.strip()
+        if self.mode is None:
+            if not stripped:
+                return
+            if stripped.startswith("```"):
+                self.mode = "fenced" if is_python_fence(stripped) else "other"
+                return
+            if stripped.lower() in LANGUAGE_TAGS:
+                return  # The tag of a fence whose backticks were lost
+            if is_prose(line):
+                self._preamble_lines += 1
+                if self._preamble_lines > self.max_preamble_lines:
+                    raise StreamAborted(f"the answer is prose, not code: {stripped[:60]!r}")
+                return
+            self.mode = "plain"
+        elif self.mode in ("between", "other"):
+            if not stripped.startswith("```"):
+                return  # Prose between the blocks, or a block that is not Python
+            if self.mode == "other":
+                self.mode = "between"
+            elif is_python_fence(stripped):
+                self.mode = "fenced"
+                if self._code_lines:
+                    self._code_lines += ["", ""]
+            else:
+                self.mode = "other"
+            return
+        elif stripped.startswith("```"):
+            if self.mode == "fenced":
+                self.mode = "between"
+            else:
+                self.done = True  # A closing fence after unfenced code
+            return
+        elif (self.mode == "plain" and line[:1] not in ("", " ", "\t") and is_prose(line)
+              and classify(self.code) == "complete"):
+            self.done = True  # An explanation after the code, like a closing fence
+            return
+
+        self._code_lines.append(line)
+        self._unchecked_lines += 1
+        if self._unchecked_lines >= self.check_every:
+            self._unchecked_lines = 0
+            if classify(self.code) == "invalid":
+                raise StreamAborted(f"syntax error by line {len(self._code_lines)} of the code")
+
+
+def _new_stats():
+    return {
+        "ttft": None,
+        "time_to_valid_code": None,
+        "total": None,
+        "restarts": 0,
+        "abort_reasons": [],
+        "valid": False,
+        "usage": None,
+    }
+
+
+def _delta_of(chunk, attempt):
+    """Text delta of a chunk; the final chunk carries the attempt's token usage instead."""
+    usage = getattr(chunk, "usage", None)
+    if usage is not None:
+        attempt["usage"] = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+        }
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _new_attempt():
+    return {"validator": StreamValidator(), "code": None, "abort_reason": None, "answered_at": None, "usage": None}
+
+
+def _on_delta(attempt, delta, stats, start_time):
+    """Feed a delta of an attempt's stream to its validator, recording the timings."""
+    if attempt["answered_at"] is not None:
+        return  # Answer complete, the rest is only read for the usage chunk at its end
+    if delta and stats["ttft"] is None:
+        stats["ttft"] = time.perf_counter() - start_time
+    if delta and attempt["validator"].feed(delta):
+        attempt["answered_at"] = time.perf_counter() - start_time
+
+
+def _settle_attempt(attempt, stats, start_time):
+    """Add an attempt to the stats; returns True when it produced valid code."""
+    if attempt["usage"] is not None:
+        if stats["usage"] is None:
+            stats["usage"] = dict(attempt["usage"])
+        else:
+            for key, value in attempt["usage"].items():
+                stats["usage"][key] += value
+    stats["total"] = time.perf_counter() - start_time
+    if attempt["abort_reason"] is not None:
+        stats["restarts"] += 1
+        stats["abort_reasons"].append(attempt["abort_reason"])
+        return False
+    stats["time_to_valid_code"] = stats["total"] if attempt["answered_at"] is None else attempt["answered_at"]
+    stats["valid"] = True
+    return True
+
+
+def _send_directly(request, usage_of):
+    return request()
+
+
+async def _send_directly_async(request, usage_of):
+    return await request()
+
+
+def _usage_of(attempt):
+    return attempt["usage"]
+
+
+def stream_completion(client, model, messages, max_restarts=2, send=None):
+    """
+    Stream a chat completion, validating the code as it arrives.
+
+    Args:
+        client (OpenAI): The client to stream from.
+        model (str): Model name.
+        messages (list): Chat messages.
+        max_restarts (int): Aborted streams retried before giving up.
+        send (callable): Sends every streamed request, restarts included: takes a
+            function making the request and a function returning the token usage
+            of its result, e.g. to go through RequestScheduler.call. Defaults to
+            sending directly.
+
+    Returns:
+        tuple: (code, stats). When every attempt was aborted the code of the
+        last attempt is returned anyway and stats["valid"] is False.
+    """
+    send = send or _send_directly
+    stats = _new_stats()
+    start_time = time.perf_counter()
+
+    def request():
+        # An abort is returned rather than raised, so that it is not mistaken for an API error to retry
+        attempt = _new_attempt()
+        stream = client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}
+        )
+        try:
+            for chunk in stream:
+                _on_delta(attempt, _delta_of(chunk, attempt), stats, start_time)
+            attempt["code"] = attempt["validator"].finish()
+        except StreamAborted as e:
+            attempt["abort_reason"] = str(e)
+        finally:
+            stream.close()
+        return attempt
+
+    for _ in range(max_restarts + 1):
+        attempt = send(request, _usage_of)
+        if _settle_attempt(attempt, stats, start_time):
+            return attempt["code"], stats
+    stats["restarts"] -= 1  # The last abort was not followed by a restart
+    return extract_code(attempt["validator"].text), stats
+
+
+async def stream_completion_async(client, model, messages, max_restarts=2, send=None):
+    """Async counterpart of stream_completion, for an AsyncOpenAI client; send returns an awaitable."""
+    send = send or _send_directly_async
+    stats = _new_stats()
+    start_time = time.perf_counter()
+
+    async def request():
+        attempt = _new_attempt()
+        stream = await client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}
+        )
+        try:
+            async for chunk in stream:
+                _on_delta(attempt, _delta_of(chunk, attempt), stats, start_time)
+            attempt["code"] = attempt["validator"].finish()
+        except StreamAborted as e:
+            attempt["abort_reason"] = str(e)
+        finally:
+            await stream.close()
+        return attempt
+
+    for _ in range(max_restarts + 1):
+        attempt = await send(request, _usage_of)
+        if _settle_attempt(attempt, stats, start_time):
+            return attempt["code"], stats
+    stats["restarts"] -= 1
+    return extract_code(attempt["validator"].text), stats
@@ -0,0 +1,214 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Answers every request with the same small program and its unit tests, with
+optional latency, its own requests-per-minute limit (429 with Retry-After)
+and random 500s, so the request scheduler and the whole pipeline can be
+exercised without an API key or any spend.
+
+Usage:
+    python stub_server.py --port 8765 --rpm 60 --error-rate 0.1
+    OPENAI_API_KEY=stub python superpythoncoder.py --base-url http://127.0.0.1:8765/v1
+"""
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ANSWER = '''import unittest
+
+
+def is_palindrome(number):
+    """Return True if the number reads the same backwards."""
+    text = str(number)
+    return text == text[::-1]
+
+
+class TestIsPalindrome(unittest.TestCase):
+    def test_palindrome(self):
+        self.assertTrue(is_palindrome(121))
+
+    def test_not_palindrome(self):
+        self.assertFalse(is_palindrome(123))
+
+    def test_single_digit(self):
+        self.assertTrue(is_palindrome(7))
+
+
+if __name__ == "__main__":
+    unittest.main()
+'''
+
+
+class StubState:
+    """
+    Settings and counters shared by the request handlers.
+
+    `window` is the number of seconds the `rpm` limit counts requests over,
+    a minute like the real API unless a test wants quicker Retry-After waits.
+    """
+
+    def __init__(self, rpm=0, error_rate=0.0, latency=0.0, answer=STUB_ANSWER, window=60.0):
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.latency = latency
+        self.answer = answer
+        self.window = window
+        self.counts = collections.Counter()
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Return None if a request is within the RPM limit, else the seconds until it would be."""
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= self.window:
+                self._recent.popleft()
+            if self.rpm and len(self._recent) >= self.rpm:
+                return self.window - (now - self._recent[0])
+            self._recent.append(now)
+            return None
+
+
+def _usage(request, answer, n):
+    prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", [])) // 4
+    completion_tokens = len(answer) // 4 * n
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handles POST .../chat/completions, streamed or not."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+    state = StubState()
+
+    def log_message(self, *args):
+        pass  # Counters are printed on exit instead
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        state = self.state
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            state.counts["404"] += 1
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+
+        wait = state.admit()
+        if wait is not None:
+            state.counts["429"] += 1
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}},
+                [("Retry-After", f"{wait:.3f}"), ("Retry-After-Ms", str(int(wait * 1000)))],
+            )
+            return
+        if random.random() < state.error_rate:
+            state.counts["500"] += 1
+            self._send_json(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+            return
+        if state.latency:
+            time.sleep(state.latency)
+
+        state.counts["200"] += 1
+        n = int(request.get("n") or 1)
+        model = request.get("model", "stub")
+        created = int(time.time())
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        usage = _usage(request, state.answer, n)
+        if request.get("stream"):
+            self._stream(completion_id, created, model, usage, request)
+            return
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {"index": index, "message": {"role": "assistant", "content": state.answer}, "finish_reason": "stop"}
+                for index in range(n)
+            ],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, created, model, usage, request):
+        """Send the answer as server-sent events, a line at a time."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(choices, **extra):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices, **extra}
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n")
+
+        for line in self.state.answer.splitlines(keepends=True):
+            chunk([{"index": 0, "delta": {"role": "assistant", "content": line}, "finish_reason": None}])
+        chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk([], usage=usage)
+        self._write_chunk("data: [DONE]\n\n")
+        self._write_chunk("")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(host="127.0.0.1", port=8765, state=None):
+    """
+    Start the stub server in a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    handler = type("Handler", (StubHandler,), {"state": state or StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0 for no limit)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    args = parser.parse_args(argv)
+
+    state = StubState(rpm=args.rpm, error_rate=args.error_rate, latency=args.latency)
+    server = serve(args.host, args.port, state)
+    print(f"Stub API listening on http://{args.host}:{args.port}/v1 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"Responses: {dict(state.counts)}")
+
+
+if __name__ == "__main__":
+    main()
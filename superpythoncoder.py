@@ -1,18 +1,51 @@
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
 import os
-import subprocess
 import random
+import threading
 from tqdm import tqdm  # For progress bar
-from openai import OpenAI
 from colorama import Fore, Style, init
-import time
 import re
+from benchmark import (
+    BenchmarkError,
+    add_benchmark_arguments,
+    benchmark_settings_from_args,
+    compare_programs,
+    report_path,
+    write_report,
+)
+from autofix import fix_until_stable
+from cache import add_cache_arguments, cache_from_args
+from lint_service import LintService
+from sandbox import SandboxPool, add_sandbox_arguments, sandbox_from_args
+from scheduler import RequestScheduler, add_scheduler_arguments, scheduler_from_args
+from speculative import check_all, race, raise_if_cancelled
+from streaming import extract_code, stream_completion
+from testcases import failure_report, run_tests, split_program
+from tracing import add_tracing_arguments, annotate, export_from_args, record_usage, traced, tracer
 
 # Initialize colorama
 init(autoreset=True)
 max_attempts = 5
+MODEL = "gpt-4o-mini"
+CODE_FILE = "generatedcode.py"
 # Set your OpenAI API key
 api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)  # Instantiate the OpenAI client
+client = None  # Created on first use, so replaying recorded responses needs no API key
+scheduler = None  # RequestScheduler every model call goes through, set up by main()
+response_cache = None  # ResponseCache set up by main(), None disables caching
+benchmark_settings = {}  # Keyword arguments for compare_programs, set up by main()
+sandbox = None  # SandboxPool running generated code, started on first use
+test_timeout = 5.0  # Wall-clock limit per test case, set up by main()
+lint_service = None  # LintService keeping pylint loaded, created on first use
+stream_responses = False  # Stream and validate completions as they arrive, set up by main()
+stream_stats = []  # Timings of every streamed completion
+candidates = 1  # Candidate answers sampled per model call, set up by main()
+model_call = None  # (event loop, coroutine function) making the model calls instead of the client, set up by batch mode
+benchmark_lock = threading.Lock()  # One benchmark at a time, also across concurrent batch jobs
 
 # Hardcoded list of programs
 PROGRAMS_LIST = [
@@ -37,100 +70,184 @@ PROGRAMS_LIST = [
     "Write a Python program to solve the N-Queens problem using backtracking and print all possible solutions for a given board size N."
 ]
 
-def auto_fix_code(code):
-    """Automatically fix simple lint issues in the code."""
-    # Remove trailing whitespace
-    fixed_code = "\n".join(line.rstrip() for line in code.splitlines())
-    
-    # Ensure the file ends with exactly one newline
-    if not fixed_code.endswith("\n"):
-        fixed_code += "\n"
-
-    # Add a module-level docstring if missing
-    if not fixed_code.lstrip().startswith('"""'):
-        docstring = '"""\nThis module provides functionality for the requested program.\n"""\n\n'
-        fixed_code = docstring + fixed_code
-
-    # Add missing docstrings for functions and classes
-    lines = fixed_code.splitlines()
-    updated_lines = []
-    for line in lines:
-        if line.strip().startswith("def ") and '"""' not in line:
-            updated_lines.append('    """Placeholder docstring."""')
-        if line.strip().startswith("class ") and '"""' not in line:
-            updated_lines.append('    """Placeholder class docstring."""')
-        updated_lines.append(line)
-    fixed_code = "\n".join(updated_lines)
-
-    return fixed_code
-
-def run_lint_check():
-    """Run pylint on the given file and return the output."""
-    result = subprocess.run(['pylint', "generatedcode.py"], capture_output=True, text=True)
-    return result.stdout  # Return lint output and success status
-
-def generate_program_with_openai_for_lint(code, max_attempts=3):
+def auto_fix_code(code, code_file=CODE_FILE):
     """
-    Generate code using OpenAI's API to resolve lint issues iteratively.
+    Resolve the mechanical pylint messages locally, without asking the model.
 
     Args:
-        code (str): The original program code.
-        max_attempts (int): Maximum number of attempts to resolve lint issues.
+        code (str): The program code.
+        code_file (str): Path the code is linted and run as.
 
     Returns:
-        str: The final generated code after resolving lint issues.
+        tuple: (code, LintResult) after the local fixes. A fix that breaks the
+        program's tests is discarded.
     """
-    lint_issues = ""  # Initialize lint issues as an empty string
+    return fix_until_stable(
+        code,
+        lint=lambda source: run_lint_check(source, code_file),
+        verify=lambda source: run_generated_code(source, code_file)["returncode"] == 0,
+    )
 
-    for attempt in tqdm(range(1, max_attempts + 1), desc="Resolving lint issues"):
+def clean_code(content):
+    """Strip the markdown code fence the model wraps around its answer."""
+    return extract_code(content)
 
-        # Prepare the messages for OpenAI API
-        messages = [
-            {
-                "role": "user",
-                "content": (
-                    f"""Fix the following Python code to resolve these pylint errors/warnings:
-                    Code:\n{code}\n\n
-                    Pylint Errors/Warnings:\n{lint_issues} just write code, no extra information and words
-                    Ensure the output is fully executable as-is in a Python environment. 
-                    Go line by line and check if the response is runnable in Python, paying attention to the first and last lines to avoid extra syntax.
-                    Make sure!!!!!!! about the last command I gave you!!!!!!!! Make it runnable with no changes at all!!!! 
-                    Delete the ```python on the first line and the closing ``` on the last line.
-                    no matter what you do, do not give output before making sure this happens!!!!!!!!!!!!! .
-                    write the code as plain text without code block"""
-                ),
-            },
-        ]
 
-        try:
-            # Call OpenAI to generate updated code
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages
-            )
-            code = response.choices[0].message.content.strip("```python\n").strip("```") + "\n"
-            lint_output = run_lint_check()
-       
-            if "10.00/10" in lint_output:
-                print(f"Lint issues resolved on attempt {attempt}.")
-                continue
+def get_scheduler():
+    """Return the shared request scheduler, creating one with the default limits on first use."""
+    global scheduler
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    return scheduler
+
+
+def get_client():
+    """Return the shared OpenAI client, instantiating it on first use."""
+    global client
+    if client is None:
+        client = get_scheduler().openai_client(api_key)
+    return client
+
+
+def ask_model_candidates(prompt, n=None, stage="generate", attempt=0):
+    """
+    Sample several answers to a single-message prompt.
+
+    Uses the API's `n` parameter, or n concurrent streams when streaming.
+
+    Args:
+        prompt (str): The prompt.
+        n (int): Number of candidates (defaults to the --candidates setting).
+        stage (str): Pipeline stage asking, which sets the call's priority in the scheduler.
+        attempt (int): Retry number of the prompt. Retries are keyed apart in the
+            cache and always sampled afresh, except in replay mode.
+
+    Returns:
+        list: The cleaned code of every candidate.
+    """
+    n = n or candidates
+    retry = {"attempt": attempt} if attempt else {}
+    messages = [
+        {"role": "user", "content": prompt}
+    ]
+    called = []
+
+    def call():
+        called.append(True)
+        if model_call is not None:
+            # Batch mode: the request runs on the batch event loop, in this thread's context
+            loop, complete = model_call
+            return asyncio.run_coroutine_threadsafe(complete(messages, n, stage), loop).result()
+        if stream_responses:
+            def stream():
+                # Every streamed request, restarts included, goes through the scheduler
+                return stream_completion(
+                    get_client(), MODEL, messages,
+                    send=lambda request, usage_of: get_scheduler().call(
+                        request, messages, stage, model=MODEL, usage_of=usage_of
+                    ),
+                )
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n) as executor:
+                # In a copy of the current context each, so the scheduler annotates the model_call span
+                futures = [executor.submit(contextvars.copy_context().run, stream) for _ in range(n)]
+                streams = [future.result() for future in futures]
+            for _, stats in streams:
+                stream_stats.append(stats)
+                record_usage(stats["usage"])
+            first = streams[0][1]
+            annotate(ttft=first["ttft"], time_to_valid_code=first["time_to_valid_code"],
+                     restarts=sum(stats["restarts"] for _, stats in streams))
+            for _, stats in streams:
+                if stats["valid"]:
+                    print(Fore.CYAN + f"First token after {stats['ttft']:.2f}s, valid code after "
+                          f"{stats['time_to_valid_code']:.2f}s ({stats['restarts']} restarts)")
+                else:
+                    print(Fore.RED + f"No valid code after {stats['restarts'] + 1} streams: {stats['abort_reasons'][-1]}")
+            return [code for code, _ in streams]
+        params = {"n": n} if n > 1 else {}
+        response = get_scheduler().call(
+            lambda: get_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                **params
+            ),
+            messages, stage, n=n, model=MODEL, usage_of=lambda response: response.usage,
+        )
+        record_usage(response.usage)
+        return [choice.message.content for choice in response.choices]
+
+    def call_single():
+        return call()[0]
+
+    with tracer.span("model_call", model=MODEL, prompt_bytes=len(prompt.encode("utf-8")), candidates=n):
+        if n == 1:
+            # Single answers are cached as a string, as they always were
+            if response_cache is None:
+                contents = [call_single()]
             else:
-                lint_issues = lint_output
-        except Exception as e:
-                print(f"Error during attempt {attempt}: {e}")
+                contents = [response_cache.fetch(MODEL, messages, call_single, fresh=bool(attempt), **retry)]
+        elif response_cache is None:
+            contents = call()
         else:
-            with open("generatedcode.py", "w", encoding="utf-8") as file:
-                file.write(code)
-    
+            contents = response_cache.fetch(MODEL, messages, call, fresh=bool(attempt), n=n, **retry)
+        annotate(response_bytes=sum(len(content.encode("utf-8")) for content in contents), cached=not called)
+    return [clean_code(content) for content in contents]
 
-    print(Fore.RED + "Reached the maximum number of attempts. Returning the best effort.")
-    return code
 
+def get_sandbox():
+    """Return the shared pool of warm execution workers, starting it on first use."""
+    global sandbox
+    if sandbox is None:
+        sandbox = SandboxPool()
+        atexit.register(sandbox.close)
+    return sandbox
+
+
+@traced("execute")
+def run_generated_code(code, code_file=CODE_FILE):
+    """Run code in a sandbox worker as if it were code_file and return the execution result."""
+    raise_if_cancelled()
+    result = get_sandbox().run(
+        code,
+        cwd=os.path.dirname(os.path.abspath(code_file)),
+        filename=os.path.basename(code_file),
+    )
+    annotate(returncode=result["returncode"], timed_out=result["timed_out"], run_wall=result["wall"],
+             outcome="passed" if result["returncode"] == 0 else "failed")
+    return result
+
+
+@traced("tests")
+def run_test_cases(program, tests, code_file=CODE_FILE):
+    """
+    Run test cases individually and in parallel in the sandbox.
+
+    Args:
+        program (SplitProgram): The program the tests belong to.
+        tests (list): The TestCase tuples to run.
+        code_file (str): Path the code runs as.
+
+    Returns:
+        dict: Test name -> execution result, for the failing tests only.
+    """
+    pool = get_sandbox()
+    cwd = os.path.dirname(os.path.abspath(code_file))
+    filename = os.path.basename(code_file)
+
+    def run(code):
+        raise_if_cancelled()
+        return pool.run(code, timeout=test_timeout, cwd=cwd, filename=filename)
 
-def generate_program_with_openai(user_input):
-    """Generate code using OpenAI's API based on the given user input."""
-    errs = ""
-    prompt = f"""Write a Python program that performs the following: {user_input}
+    results = run_tests(program, tests, run, workers=pool.size)
+    failures = {name: result for name, result in results.items() if result["returncode"] != 0}
+    annotate(tests=len(tests), failed=len(failures), outcome="failed" if failures else "passed")
+    return failures
+
+
+def generation_prompt(user_input):
+    """Build the prompt asking for a program and its unit tests."""
+    return f"""Write a Python program that performs the following: {user_input}
     Provide only the runnable Python code and corresponding unit tests as plain text, without any explanations, comments, or additional formatting.
     Ensure the code includes edge cases in the tests and produces the correct output for all cases.
     Do not include any text other than the code and the tests.
@@ -140,68 +257,53 @@ def generate_program_with_openai(user_input):
     Delete the ```python\ on the first line and the closing ``` on the\u00a0last\u00a0line.
     Delete this ```python and this ```
     write the code as plain text without code block"""
-    messages = [
-        {"role": "user", "content": prompt}
-    ]
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
-        )
-    
-    generated_code = response.choices[0].message.content.strip("```python\n").strip("```")+ "\n"
-    with open("generatedcode.py", "w") as file:
-        file.write(generated_code)
-        
 
-    try:
-        subprocess.run(["python","generatedcode.py"], capture_output=True, text=True, check=True)
-    except subprocess.CalledProcessError as e:
-        errs = e.stderr
-        print(Fore.RED + f"Error running generated code! Eror:{errs}. Trying again.") 
-        for i in tqdm(range (1,max_attempts-1), desc="Retrying code generation"):
-            prompt = (
-                "Write a Python program that does the following:\n" 
-                + user_input + "\n"
-                "Notice the previous code failed some tests. Please fix the code and try again. "
-                "Keep the same tests!!!!! Do not change it!!!! Only fix the code!\n"
-                + generated_code + "\n"
-                "These are the erors:\n" + errs + "\n"
-                "Provide only the Python code as plain text, without any explanations, comments, or formatting markers.\n"
-                "Do not include any text other than the code and the tests.\n"
-                "After writing the code, check line by line and erase any ```python prefix and ``` suffix from the code. "
-                "Make it runnable Python code!!!!!!!!!!!!!! do it!!!!.\n"
-                "Delete this ```python and this ```!!!!!!! do not give ouptut before making sure this happens!!!!!!!!!!!!! .\n"
-                "write the code as plain text without code block"
-)
 
-            messages = [
-            {"role": "user", "content": prompt}
-            ]
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages
-            )
-            generated_code = response.choices[0].message.content.strip("```python\n").strip("```") + "\n"
-            with open("generatedcode.py", "w") as file:
-                file.write(generated_code)
-            try:
-                subprocess.run(["python","generatedcode.py"], capture_output=True, text=True, check=True)
-            except subprocess.CalledProcessError as error:
-                errs = error.stderr
-                print(Fore.RED + f"Error running generated code! Eror:{errs}. Trying again.")
-                continue
-            else:
-                print(Fore.GREEN + "All tests passed successfully")
-                return generated_code, True 
-        return generated_code, False
-    else:
-        print(Fore.GREEN + "All tests passed successfully")
-        return generated_code, True
+def retry_prompt(user_input, generated_code, errs):
+    """Build the prompt asking the model to fix code that failed its tests."""
+    return (
+        "Write a Python program that does the following:\n"
+        + user_input + "\n"
+        "Notice the previous code failed some tests. Please fix the code and try again. "
+        "Keep the same tests!!!!! Do not change it!!!! Only fix the code!\n"
+        + generated_code + "\n"
+        "These are the erors:\n" + errs + "\n"
+        "Provide only the Python code as plain text, without any explanations, comments, or formatting markers.\n"
+        "Do not include any text other than the code and the tests.\n"
+        "After writing the code, check line by line and erase any ```python prefix and ``` suffix from the code. "
+        "Make it runnable Python code!!!!!!!!!!!!!! do it!!!!.\n"
+        "Delete this ```python and this ```!!!!!!! do not give ouptut before making sure this happens!!!!!!!!!!!!! .\n"
+        "write the code as plain text without code block"
+    )
 
 
-def optimized_code_with_openai(generated_code):
-    """Optimize code using OpenAI's API based on the given code."""
-    prompt = (
+def test_failure_prompt(user_input, program, failures, code_file=CODE_FILE):
+    """
+    Build the prompt asking the model to fix an implementation, showing only the failing tests.
+
+    The tests are not sent back as a whole and the model is asked for the
+    implementation only: the original tests are re-attached unchanged.
+    """
+    report = failure_report(program, failures, os.path.basename(code_file))
+    if not program.has_tests:
+        return retry_prompt(user_input, program.code, report)
+    return (
+        "Write a Python program that does the following:\n"
+        + user_input + "\n"
+        "This is the current implementation:\n"
+        + program.implementation + "\n"
+        "It fails these tests:\n"
+        + report + "\n"
+        "Fix the implementation so that these tests pass. Do not write any tests, "
+        "the original tests are added back to your code unchanged.\n"
+        "Provide only the fixed implementation as plain text, without any explanations, comments, or formatting markers.\n"
+        "write the code as plain text without code block"
+    )
+
+
+def optimization_prompt(generated_code):
+    """Build the prompt asking the model to speed up working code."""
+    return (
         "According to the instructionsn improve the code if possible. \n"
         "The instruction is:\n"
         "If you can't, write the same code again. Include the unit tests as well, make sure it's exactly the same tests as before.\n"
@@ -211,47 +313,250 @@ def optimized_code_with_openai(generated_code):
         'Delete the """python" from all.\n'
         "write the code as plain text without code block.\n"
         "The code is:\n"
-        + generated_code 
+        + generated_code
         + "\n"
     )
 
-    messages = [
-        {"role": "user", "content": prompt}
-    ]
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-    )
-    optimized_code = response.choices[0].message.content.strip("```python\n").strip("```") + "\n"
 
-    # Measure the execution time of the original code
-    start_time = time.time()
-    subprocess.run(["python","generatedcode.py"], capture_output=True, text=True, check=True)
-    end_time = time.time()
-    old_code_time = end_time - start_time
+def lint_prompt(code, lint_issues):
+    """Build the prompt asking the model to resolve pylint findings."""
+    return f"""Fix the following Python code to resolve these pylint errors/warnings:
+                    Code:\n{code}\n\n
+                    Pylint Errors/Warnings:\n{lint_issues} just write code, no extra information and words
+                    Ensure the output is fully executable as-is in a Python environment. 
+                    Go line by line and check if the response is runnable in Python, paying attention to the first and last lines to avoid extra syntax.
+                    Make sure!!!!!!! about the last command I gave you!!!!!!!! Make it runnable with no changes at all!!!! 
+                    Delete the ```python on the first line and the closing ``` on the last line.
+                    no matter what you do, do not give output before making sure this happens!!!!!!!!!!!!! .
+                    write the code as plain text without code block"""
+
+
+def get_lint_service():
+    """Return the shared in-process lint service, creating it on first use."""
+    global lint_service
+    if lint_service is None:
+        lint_service = LintService()
+    return lint_service
+
+
+@traced("pylint")
+def run_lint_check(code, code_file=CODE_FILE):
+    """Lint the given code as if it were code_file and return the LintResult."""
+    raise_if_cancelled()
+    service = get_lint_service()
+    hits = service.hits
+    lint_result = service.lint(code, filename=os.path.basename(code_file))
+    annotate(score=lint_result.score, messages=len(lint_result.messages), cached=service.hits > hits)
+    return lint_result
+
+@traced("lint")
+def generate_program_with_openai_for_lint(code, max_attempts=3, code_file=CODE_FILE):
+    """
+    Generate code using OpenAI's API to resolve lint issues iteratively.
+
+    Args:
+        code (str): The original program code.
+        max_attempts (int): Maximum number of attempts to resolve lint issues.
+        code_file (str): Path of the file the final code is written to.
+
+    Returns:
+        str: The final generated code after resolving lint issues.
+    """
+    # Fix what can be fixed locally, only the remaining messages go to the model
+    fixed_code, lint_result = auto_fix_code(code, code_file)
+    if fixed_code != code:
+        code = fixed_code
+        with open(code_file, "w", encoding="utf-8") as file:
+            file.write(code)
+    if lint_result.clean:
+        print(Fore.GREEN + "No lint issues left after local fixes.")
+        annotate(attempts=0, score=lint_result.score, outcome="clean")
+        return code
+
+    for attempt in tqdm(range(1, max_attempts + 1), desc="Resolving lint issues"):
+
+        try:
+            # Call OpenAI to generate updated code, keeping the best of the candidates
+            answers = ask_model_candidates(
+                lint_prompt(code, lint_result.text(os.path.basename(code_file))), stage="lint",
+                attempt=attempt - 1,
+            )
+            fixed_code, fixed_result = race(
+                lambda answer: auto_fix_code(answer, code_file),
+                answers,
+                accept=lambda fixed: fixed[1].clean,
+                score=lambda fixed: fixed[1].score,
+            )
+        except Exception as e:
+                print(f"Error during attempt {attempt}: {e}")
+                continue
+
+        # Keep the best scoring version, the model does not always improve things
+        if fixed_result.score >= lint_result.score:
+            code, lint_result = fixed_code, fixed_result
+            with open(code_file, "w", encoding="utf-8") as file:
+                file.write(code)
+        if lint_result.clean:
+            print(Fore.GREEN + f"Lint issues resolved on attempt {attempt}.")
+            annotate(attempts=attempt, score=lint_result.score, outcome="clean")
+            return code
     
-    # Save the optimized code to a file
-    with open("generatedcode.py", "w", encoding="utf-8") as file:
-        file.write(optimized_code)
+
+    print(Fore.RED + f"Reached the maximum number of attempts. Returning the best effort ({lint_result.score:.2f}/10).")
+    annotate(attempts=max_attempts, score=lint_result.score, outcome="unclean")
+    return code
+
+
+def check_program(program, tests, code_file=CODE_FILE):
+    """
+    Run the given tests of a program, then the whole program once they pass.
+
+    Returns:
+        tuple: (program, failures), where failures maps test names to the
+        execution results of the failing tests and is empty when all passed.
+    """
+    failures = run_test_cases(program, tests, code_file)
+    if failures or not program.has_tests:
+        # Without test cases the single test already was a run of the whole program
+        return program, failures
+    result = run_generated_code(program.code, code_file)
+    if result["returncode"] == 0:
+        return program, {}
+    # The whole program fails although the tests that were run pass
+    return program, run_test_cases(program, program.tests, code_file) or {"program": result}
+
+
+def pick_program(programs, failing=None, code_file=CODE_FILE):
+    """
+    Check candidate programs concurrently and keep the first one that passes.
+
+    Args:
+        programs (list): Candidate SplitPrograms.
+        failing (set): Positions of the tests that failed before; only these run
+            before the final full run. None runs every test.
+        code_file (str): Path the code runs as.
+
+    Returns:
+        tuple: (program, failures) of the first passing candidate, or of the
+        one with the fewest failures.
+    """
+    def check(program):
+        tests = [test for index, test in enumerate(program.tests) if failing is None or index in failing]
+        return check_program(program, tests or program.tests, code_file)
+
+    return race(check, programs, accept=lambda checked: not checked[1], score=lambda checked: -len(checked[1]))
+
+
+@traced("generate")
+def generate_program_with_openai(user_input, code_file=CODE_FILE):
+    """
+    Generate code using OpenAI's API based on the given user input.
+
+    The tests of the generated program run individually and in parallel. A
+    retry only sends the failing tests and asks for a new implementation, and
+    only the tests that failed are run again; once they pass, the whole
+    program runs once more to make sure nothing else broke. With several
+    candidates per call, the first candidate that passes is kept.
+
+    Returns:
+        tuple: (code, passed)
+    """
+    programs = [split_program(code) for code in ask_model_candidates(generation_prompt(user_input))]
+    program, failures = pick_program(programs, code_file=code_file)
+    with open(code_file, "w") as file:
+        file.write(program.code)
+
+    attempt = 1
+    with tracer.span("generate.retry"):
+        while failures:
+            print(Fore.RED + f"{len(failures)} of {len(program.tests)} tests failed:\n"
+                  f"{failure_report(program, failures, os.path.basename(code_file))}")
+            if attempt >= max_attempts - 1:
+                break
+            attempt += 1
+            annotate(attempts=attempt - 1)
+            print(Fore.CYAN + f"Retrying code generation (attempt {attempt})")
+            answers = ask_model_candidates(
+                test_failure_prompt(user_input, program, failures, code_file), attempt=attempt - 1
+            )
+            # Tests that passed already are skipped until the final full run
+            program, failures = pick_program(
+                [program.with_implementation(answer) for answer in answers], program.positions(failures), code_file
+            )
+            with open(code_file, "w") as file:
+                file.write(program.code)
+        else:
+            print(Fore.GREEN + "All tests passed successfully")
+    annotate(attempts=attempt, tests=len(program.tests), outcome="failed" if failures else "passed")
+    return program.code, not failures
+
+
+def candidate_path(code_file, index=None):
+    """Path an optimized candidate is written to while it is benchmarked."""
+    root, extension = os.path.splitext(code_file)
+    return root + "_candidate" + ("" if index is None else str(index)) + extension
+
+
+@traced("optimize")
+def optimized_code_with_openai(generated_code, code_file=CODE_FILE):
+    """
+    Optimize code using OpenAI's API based on the given code.
+
+    With several candidates, every candidate that passes its tests is
+    benchmarked against the original and the fastest accepted one is kept.
+    """
+    answers = ask_model_candidates(optimization_prompt(generated_code), stage="optimize")
+
+    # Save the optimized code next to the original so both can be benchmarked
+    candidate_files = [
+        candidate_path(code_file, index if len(answers) > 1 else None)
+        for index in range(1, len(answers) + 1)
+    ]
+    for candidate_file, optimized_code in zip(candidate_files, answers):
+        with open(candidate_file, "w", encoding="utf-8") as file:
+            file.write(optimized_code)
+    benchmarked = []
     try:
-        start_time = time.time()
-        subprocess.run(["python", "generatedcode.py"], capture_output=True, text=True, check=True)
-        end_time = time.time()
-    except subprocess.CalledProcessError as e:
-        print(Fore.RED + f"Error running optimized code! Error: {e.stderr}")
-        with open("generatedcode.py", "w", encoding="utf-8") as file:
-            file.write(generated_code)
+        results = check_all(lambda candidate: run_generated_code(*candidate), list(zip(answers, candidate_files)))
+        # Benchmarks run one at a time, concurrent runs would disturb each other's timings
+        for optimized_code, candidate_file, result in zip(answers, candidate_files, results):
+            if result["returncode"] != 0:
+                print(Fore.RED + f"Error running optimized code! Error: {result['stderr']}")
+                continue
+            try:
+                with benchmark_lock:
+                    report = compare_programs(code_file, candidate_file, sandbox=get_sandbox(), **benchmark_settings)
+            except BenchmarkError as e:
+                print(Fore.RED + f"Error benchmarking optimized code! Error: {e}")
+                continue
+            benchmarked.append((optimized_code, report))
+    finally:
+        for candidate_file in candidate_files:
+            os.remove(candidate_file)
+    annotate(candidates=len(answers), benchmarked=len(benchmarked))
+    if not benchmarked:
+        annotate(outcome="failed")
         return generated_code
+
+    optimized_code, report = min(
+        benchmarked, key=lambda item: (not item[1]["accept"], item[1]["program"]["relative_change"])
+    )
+    if len(answers) > 1:
+        report["candidates"] = [
+            {"accept": other["accept"], "relative_change": other["program"]["relative_change"]}
+            for _, other in benchmarked
+        ]
+    write_report(report, report_path(code_file))
+    change = report["program"]["relative_change"]
+    annotate(relative_change=change, outcome="accepted" if report["accept"] else "rejected")
+    if report["accept"]:
+        print(Fore.GREEN + f"Optimized code is faster than the original code ({change:+.1%} median run time)")
+        with open(code_file, "w", encoding="utf-8") as file:
+            file.write(optimized_code)
+        return optimized_code
     else:
-        new_code_time = end_time - start_time
-        if new_code_time < old_code_time:
-            print(Fore.GREEN + "Optimized code is faster than the original code")
-            return optimized_code
-        else:
-            print(Fore.RED + "Optimized code is slower than the original code")
-            with open("generatedcode.py", "w", encoding="utf-8") as file:
-                file.write(generated_code)
-            return generated_code
+        print(Fore.RED + f"Optimized code is not significantly faster than the original code ({change:+.1%} median run time)")
+        return generated_code
 
 
 def get_program_from_user():
@@ -268,19 +573,43 @@ def get_program_from_user():
     return user_input
 
 
-def main():
+def main(argv=None):
+    global response_cache, benchmark_settings, sandbox, stream_responses, test_timeout, candidates, scheduler
+    parser = argparse.ArgumentParser(description="Super Python Coder")
+    parser.add_argument("--stream", action="store_true", help="stream completions and abort malformed answers early")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="candidate answers sampled per model call, checked concurrently")
+    add_cache_arguments(parser)
+    add_benchmark_arguments(parser)
+    add_sandbox_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_tracing_arguments(parser)
+    args = parser.parse_args(argv)
+    response_cache = cache_from_args(args)
+    benchmark_settings = benchmark_settings_from_args(args)
+    sandbox = sandbox_from_args(args)
+    test_timeout = args.test_timeout
+    candidates = max(1, args.candidates)
+    scheduler = scheduler_from_args(args)
+    stream_responses = args.stream
+
     print(Fore.GREEN + Style.BRIGHT + "Welcome to Super Python Coder!")
     program_prompt = get_program_from_user()
 
-    # First pass: Generate initial code
-    print(Fore.CYAN + f"Generating initial code for: {program_prompt}")
-    generated_code, status = generate_program_with_openai(program_prompt)
-    if not status:
-        print(Fore.RED + "Failed to generate code that passes the tests.")
-        return
-    optimized_code = optimized_code_with_openai(generated_code)
+    try:
+        # First pass: Generate initial code
+        print(Fore.CYAN + f"Generating initial code for: {program_prompt}")
+        generated_code, status = generate_program_with_openai(program_prompt)
+        if not status:
+            print(Fore.RED + "Failed to generate code that passes the tests.")
+            return
+        optimized_code = optimized_code_with_openai(generated_code)
 
-    optimized_code = generate_program_with_openai_for_lint(optimized_code)
+        optimized_code = generate_program_with_openai_for_lint(optimized_code)
+    finally:
+        print(Fore.CYAN + "\n" + tracer.summary_table())
+        print(Fore.CYAN + scheduler.summary())
+        export_from_args(args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,418 @@
+"""
+Split generated programs into their implementation and their test cases.
+
+The model answers with one file holding both the code and its tests. Running
+that file as a whole only says "something failed" and the retry prompt then
+has to carry the full program and the full stderr. Instead, the program is
+parsed with `ast` and split into:
+
+* the implementation: everything that is not a test;
+* the test cases: every `test*` method of a unittest.TestCase subclass, every
+  top-level `test_*` function and every statement holding an `assert`
+  (at the top level or under `if __name__ == "__main__":`);
+* the test block: the source of all of the above, kept verbatim so that the
+  tests can be re-attached unchanged to a new implementation.
+
+Each test case then runs as its own small program (the implementation plus
+that one test), so the cases can run in parallel, with their own timeout, and
+the failing ones can be reported and re-run on their own.
+
+A program in which no test case is found is treated as a single "program"
+test, which runs the whole file as before.
+"""
+import ast
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import os
+import re
+import textwrap
+
+MAX_REPORTED_FAILURES = 10
+MAX_TRACEBACK_LINES = 12
+
+TestCase = collections.namedtuple("TestCase", "name kind source snippet call")
+
+UNITTEST_CALL = """import sys as _sys
+import unittest as _unittest
+_result = _unittest.TextTestRunner(verbosity=0).run(_unittest.TestSuite([{name}]))
+_sys.exit(0 if _result.wasSuccessful() else 1)
+"""
+
+_NOISE = re.compile(
+    r"^(?:[=\-]{10,}|[.EFsxu]+|Ran \d+ tests? in .*|FAILED \(.*\)|OK"
+    r"|Traceback \(most recent call last\):|\s*[\^~]+)$"
+)
+_FRAME = re.compile(r'^\s*File "(?P<path>[^"]+)", line (?P<line>\d+)(?P<rest>.*)$')
+
+
+class SplitProgram(collections.namedtuple("SplitProgram", "implementation tests test_block")):
+    """Implementation, test cases and verbatim test source of a generated program."""
+
+    __slots__ = ()
+
+    @property
+    def has_tests(self):
+        """False when no test case was found and the whole program is the only test."""
+        return bool(self.test_block)
+
+    @property
+    def code(self):
+        """The whole program: the implementation followed by the tests."""
+        if not self.test_block:
+            return self.implementation
+        return self.implementation.rstrip() + "\n\n\n" + self.test_block.rstrip() + "\n"
+
+    def positions(self, names):
+        """Positions in `tests` of the tests with these names; with_implementation keeps them."""
+        return {index for index, test in enumerate(self.tests) if test.name in names}
+
+    def program_for(self, test):
+        """Code that runs the implementation and this one test, exiting non-zero if it fails."""
+        parts = [self.implementation.rstrip()]
+        if test.source:
+            parts.append(test.source.rstrip())
+        if test.call:
+            parts.append(test.call.rstrip())
+        return "\n\n\n".join(part for part in parts if part) + "\n"
+
+    def with_implementation(self, code):
+        """
+        Replace the implementation, keeping the original tests.
+
+        Tests the model wrote anyway are dropped, and imports of the old
+        implementation that the new one lost are added back since the tests
+        may rely on them.
+        """
+        if not self.has_tests:
+            return split_program(code)
+        try:
+            implementation = _split(code)[0]
+        except (SyntaxError, ValueError):
+            implementation = code
+        present = set(_imports(implementation))
+        missing = [line for line in _imports(self.implementation) if line not in present]
+        if missing:
+            implementation = _insert_imports(implementation, missing)
+        # Assert tests are named after their line in `code`, which moves with the implementation's length
+        shift = implementation.rstrip().count("\n") - self.implementation.rstrip().count("\n")
+        tests = [
+            test._replace(name=f"line {int(test.name.split()[1]) + shift}") if test.kind == "assert" else test
+            for test in self.tests
+        ]
+        return self._replace(implementation=implementation, tests=tests)
+
+
+def split_program(code):
+    """
+    Split a generated program into its implementation and its test cases.
+
+    Args:
+        code (str): The program, as answered by the model.
+
+    Returns:
+        SplitProgram: The split program. When the code does not parse or holds
+        no test case, the whole code is the implementation and the only test
+        runs it as-is.
+    """
+    try:
+        implementation, tests, test_block = _split(code)
+    except (SyntaxError, ValueError):
+        return _whole_program(code)
+    if not tests:
+        return _whole_program(code)
+    return SplitProgram(implementation, tests, test_block)
+
+
+def _split(code):
+    """Return the implementation, test cases and test block of some code; raises SyntaxError."""
+    tree = ast.parse(code)
+    lines = code.splitlines(keepends=True)
+
+    test_classes = {node.name for node in tree.body if _is_test_class(node)}
+    test_functions = {node.name for node in tree.body if _is_test_function(node)}
+    test_names = test_classes | test_functions
+
+    tests = []
+    test_nodes = []
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name in test_classes:
+            class_source = "import unittest\n\n\n" + _segment(lines, node)
+            for method in node.body:
+                if isinstance(method, ast.FunctionDef) and method.name.startswith("test"):
+                    name = f"{node.name}.{method.name}"
+                    tests.append(TestCase(
+                        name, "unittest", class_source, textwrap.dedent(_segment(lines, method)),
+                        UNITTEST_CALL.format(name=f"{node.name}({method.name!r})"),
+                    ))
+            test_nodes.append(node)
+        elif isinstance(node, ast.FunctionDef) and node.name in test_functions:
+            source = _segment(lines, node)
+            if _takes_no_arguments(node):
+                tests.append(TestCase(node.name, "function", source, source, f"{node.name}()\n"))
+            test_nodes.append(node)
+        elif _is_main_guard(node):
+            tests.extend(_main_guard_tests(lines, node, test_names))
+            test_nodes.append(node)
+        elif not _is_definition(node) and _contains_assert(node):
+            source = _segment(lines, node)
+            tests.append(TestCase(node.lineno, "assert", source, source, ""))
+            test_nodes.append(node)
+        elif not _is_definition(node) and _runs_tests(node, test_names):
+            test_nodes.append(node)  # e.g. test_foo() or unittest.main() at the top level
+
+    removed = set()
+    for node in test_nodes:
+        removed.update(range(_first_line(node) - 1, node.end_lineno))
+    implementation = "".join(line for index, line in enumerate(lines) if index not in removed)
+    test_block = "\n\n".join(_segment(lines, node).rstrip() + "\n" for node in test_nodes)
+
+    # Assert tests were numbered by their line in the answer; name them after their line in
+    # SplitProgram.code instead, which is the program the reports and tracebacks refer to
+    renumbered = {}
+    start = implementation.rstrip().count("\n") + 4  # After the implementation and two blank lines
+    for node in test_nodes:
+        first = _first_line(node)
+        renumbered.update((line, start + line - first) for line in range(first, node.end_lineno + 1))
+        start += node.end_lineno - first + 3
+    tests = [
+        test._replace(name=f"line {renumbered[test.name]}") if test.kind == "assert" else test
+        for test in tests
+    ]
+    return implementation.rstrip() + "\n", tests, test_block
+
+
+def _whole_program(code):
+    return SplitProgram(code, [TestCase("program", "program", "", "", "")], "")
+
+
+def _first_line(node):
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+
+def _segment(lines, node):
+    return "".join(lines[_first_line(node) - 1:node.end_lineno])
+
+
+def _is_definition(node):
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom))
+
+
+def _is_test_class(node):
+    if not isinstance(node, ast.ClassDef):
+        return False
+    for base in node.bases:
+        name = base.attr if isinstance(base, ast.Attribute) else getattr(base, "id", "")
+        if name.endswith("TestCase"):
+            return True
+    return False
+
+
+def _is_test_function(node):
+    return isinstance(node, ast.FunctionDef) and node.name.startswith("test")
+
+
+def _takes_no_arguments(function):
+    arguments = function.args
+    positional = len(arguments.posonlyargs) + len(arguments.args)
+    return positional == len(arguments.defaults) and None not in arguments.kw_defaults
+
+
+def _is_main_guard(node):
+    if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+        return False
+    operands = [node.test.left, *node.test.comparators]
+    names = {operand.id for operand in operands if isinstance(operand, ast.Name)}
+    values = {operand.value for operand in operands if isinstance(operand, ast.Constant)}
+    return names == {"__name__"} and values == {"__main__"}
+
+
+def _contains_assert(node):
+    return any(isinstance(child, ast.Assert) for child in ast.walk(node))
+
+
+def _runs_tests(node, test_names):
+    """True for a statement that refers to a test or calls unittest.main()."""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id in test_names:
+            return True
+        if (isinstance(child, ast.Attribute) and child.attr == "main"
+                and isinstance(child.value, ast.Name) and child.value.id == "unittest"):
+            return True
+    return False
+
+
+def _main_guard_tests(lines, guard, test_names):
+    """One test per assert statement under the main guard, run after the setup statements before it."""
+    tests = []
+    setup = []
+    for statement in guard.body:
+        source = textwrap.dedent(_segment(lines, statement))
+        if _contains_assert(statement):
+            tests.append(TestCase(
+                statement.lineno, "assert", "".join(setup) + source, source, ""
+            ))  # Named once the layout of the whole program is known
+        elif not _runs_tests(statement, test_names):
+            setup.append(source)
+    return tests
+
+
+def _imports(code):
+    """Source of the top-level import statements of some code."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+    lines = code.splitlines(keepends=True)
+    return [
+        _segment(lines, node).strip()
+        for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+
+
+def _insert_imports(code, imports):
+    """Add import lines to some code, after its module docstring if it has one."""
+    lines = code.splitlines(keepends=True)
+    position = 0
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        tree = None
+    if tree and tree.body and isinstance(tree.body[0], ast.Expr) \
+            and isinstance(tree.body[0].value, ast.Constant) and isinstance(tree.body[0].value.value, str):
+        position = tree.body[0].end_lineno
+    block = [line + "\n" for line in imports]
+    return "".join(lines[:position] + block + lines[position:])
+
+
+def run_tests(program, tests, run, workers=None):
+    """
+    Run every test as its own program, in parallel.
+
+    Args:
+        program (SplitProgram): The program the tests belong to.
+        tests (list): The TestCase tuples to run.
+        run (callable): Executes a code string and returns an execution result
+            dict (e.g. SandboxPool.run with the timeout and cwd bound).
+        workers (int): Number of tests running at once (defaults to all of them).
+
+    Returns:
+        dict: Test name -> execution result, in test order.
+    """
+    if not tests:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(tests)) as executor:
+        # Each test runs in a copy of the caller's context (its trace span, the race it belongs to)
+        futures = [
+            executor.submit(contextvars.copy_context().run, run, program.program_for(test))
+            for test in tests
+        ]
+        results = [future.result() for future in futures]
+    return {test.name: result for test, result in zip(tests, results)}
+
+
+async def run_tests_async(program, tests, run):
+    """Async counterpart of run_tests; run is a coroutine function."""
+    results = await asyncio.gather(*(run(program.program_for(test)) for test in tests))
+    return {test.name: result for test, result in zip(tests, results)}
+
+
+def line_map(program, test):
+    """
+    Map the line numbers of the program that runs one test back to the whole program.
+
+    The implementation comes first in both. The test's source is located in
+    the whole program's tests from its end, since the `import unittest` added
+    in front of a test class and the setup statements of a main guard test
+    are not there as-is.
+
+    Returns:
+        dict: Line of program.program_for(test) -> line of program.code. Lines
+        that only exist in the test's program (e.g. the runner call) are missing.
+    """
+    implementation_lines = program.implementation.rstrip().count("\n") + 1
+    mapping = {line: line for line in range(1, implementation_lines + 1)}
+    if not test.source:
+        return mapping
+    code_lines = [line.strip() for line in program.code.splitlines()]
+    source_lines = [line.strip() for line in test.source.rstrip().splitlines()]
+    source_start = implementation_lines + 3  # After the two blank lines program_for puts in between
+    for length in range(len(source_lines), 0, -1):
+        block = source_lines[-length:]
+        for index in range(implementation_lines, len(code_lines) - length + 1):
+            if code_lines[index:index + length] == block:
+                first = source_start + len(source_lines) - length
+                mapping.update((first + offset, index + 1 + offset) for offset in range(length))
+                return mapping
+    return mapping
+
+
+def compact_traceback(stderr, filename, max_lines=MAX_TRACEBACK_LINES, lines=None):
+    """
+    Shorten the stderr of a failed test to the part worth showing the model.
+
+    unittest banners and frames outside the generated file are dropped, paths
+    are reduced to the file name and only the last `max_lines` lines are kept.
+    With `lines` (see line_map), line numbers are translated and the ones
+    without a counterpart are dropped.
+    """
+    kept = []
+    skipping_frame = False
+    for line in stderr.splitlines():
+        if skipping_frame and line.startswith("    "):
+            continue  # Source line of a frame outside the generated file
+        skipping_frame = False
+        if not line.strip() or _NOISE.match(line.strip()):
+            continue
+        frame = _FRAME.match(line)
+        if frame:
+            if os.path.basename(frame.group("path")) != filename:
+                skipping_frame = True
+                continue
+            number = int(frame.group("line"))
+            if lines is not None:
+                number = lines.get(number)
+            location = f", line {number}" if number is not None else ""
+            line = f'  File "{filename}"{location}{frame.group("rest")}'
+        kept.append(line.rstrip())
+    return "\n".join(kept[-max_lines:])
+
+
+def failure_report(program, failures, filename, max_failures=MAX_REPORTED_FAILURES):
+    """
+    Describe the failing tests for a retry prompt: each test's code and its compact traceback.
+
+    Identical tracebacks (e.g. the implementation failing to import) are only
+    written once.
+
+    Args:
+        program (SplitProgram): The program the tests belong to.
+        failures (dict): Test name -> execution result of the failing tests.
+        filename (str): Name the code ran under.
+        max_failures (int): Failing tests described at most.
+
+    Returns:
+        str: The report.
+    """
+    tests = {test.name: test for test in program.tests}
+    seen = {}
+    sections = []
+    for name, result in list(failures.items())[:max_failures]:
+        # Line numbers refer to the program written for the test, report them in the whole program
+        lines = line_map(program, tests[name]) if name in tests else None
+        traceback_text = compact_traceback(result["stderr"], filename, lines=lines) \
+            or f"exit status {result['returncode']}"
+        section = f"Test {name}:\n"
+        if name in tests and tests[name].snippet:
+            section += textwrap.indent(tests[name].snippet.rstrip(), "    ") + "\n"
+        if traceback_text in seen:
+            section += f"Error: same as test {seen[traceback_text]}\n"
+        else:
+            seen[traceback_text] = name
+            section += "Error:\n" + traceback_text + "\n"
+        sections.append(section)
+    if len(failures) > max_failures:
+        sections.append(f"... and {len(failures) - max_failures} more failing tests\n")
+    return "\n".join(sections)
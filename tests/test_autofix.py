@@ -0,0 +1,94 @@
+import ast
+
+from autofix import MODULE_DOCSTRING, fix_invalid_names, fix_lint_messages, fix_until_stable
+from lint_service import LintMessage, LintResult
+
+CODE = '''import os
+import json
+def addOne(someValue):
+    return someValue + 1
+class Counter:
+    def total(self):
+        return addOne(1)
+print(addOne(2), "addOne")
+'''
+
+MESSAGES = [
+    LintMessage("C0114", "missing-module-docstring", 1, 0, "Missing module docstring"),
+    LintMessage("W0611", "unused-import", 1, 0, "Unused import os"),
+    LintMessage("W0611", "unused-import", 2, 0, "Unused import json"),
+    LintMessage("C0116", "missing-function-docstring", 3, 0, "Missing function or method docstring"),
+    LintMessage("C0103", "invalid-name", 3, 0, 'Function name "addOne" doesn\'t conform to snake_case naming style'),
+    LintMessage("C0303", "trailing-whitespace", 4, 0, "Trailing whitespace"),
+    LintMessage("C0115", "missing-class-docstring", 5, 0, "Missing class docstring"),
+]
+
+
+def test_fixes_the_reported_messages():
+    fixed, handled = fix_lint_messages(CODE, MESSAGES)
+
+    assert set(handled) == set(MESSAGES)
+    tree = ast.parse(fixed)
+    assert ast.get_docstring(tree) == MODULE_DOCSTRING
+    assert not [node for node in tree.body if isinstance(node, ast.Import)]
+    assert "def add_one(someValue):" in fixed
+    assert "return add_one(1)" in fixed
+    assert '"addOne"' in fixed  # Strings are left alone
+    assert not any(line != line.rstrip() for line in fixed.splitlines())
+    functions = {node.name: node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.ClassDef))}
+    assert ast.get_docstring(functions["add_one"])
+    assert ast.get_docstring(functions["Counter"])
+
+
+def test_leaves_unfixable_messages_alone():
+    message = LintMessage("W0612", "unused-variable", 2, 4, "Unused variable 'x'")
+    code = "def f():\n    x = 1\n"
+
+    assert fix_lint_messages(code, [message]) == (code, [])
+
+
+def test_leaves_code_that_does_not_parse_alone():
+    code = "def f(:\n    pass   \n"
+    message = LintMessage("C0303", "trailing-whitespace", 2, 0, "Trailing whitespace")
+
+    assert fix_lint_messages(code, [message]) == (code, [])
+
+
+def invalid_name(kind, name, style):
+    return LintMessage("C0103", "invalid-name", 1, 0, f'{kind} name "{name}" doesn\'t conform to {style} naming style')
+
+
+def test_renames_leave_keyword_arguments_and_shadowed_names_alone():
+    code = (
+        "reverse = True\n"
+        "n = 2\n"
+        "def largest(board, n):\n"
+        "    return sorted(board, reverse=reverse)[:n]\n"
+        "print(largest([3, 1, 2], n))\n"
+    )
+    messages = [invalid_name("Constant", "reverse", "UPPER_CASE"), invalid_name("Constant", "n", "UPPER_CASE")]
+
+    fixed = fix_invalid_names(code, messages)
+
+    assert fixed.startswith("REVERSE = True\nn = 2\n")
+    assert "sorted(board, reverse=REVERSE)[:n]" in fixed
+    assert "def largest(board, n):" in fixed
+
+
+def test_rejected_rename_keeps_the_other_fixes():
+    code = "def someName():\n    return 1\n"
+
+    def lint(source):
+        messages = []
+        if not source.startswith('"""'):
+            messages.append(LintMessage("C0114", "missing-module-docstring", 1, 0, "Missing module docstring"))
+        if "someName" in source:
+            messages.append(invalid_name("Function", "someName", "snake_case"))
+        return LintResult(10.0 - len(messages), messages)
+
+    # The tests still call someName(), so the rename breaks them
+    fixed, result = fix_until_stable(code, lint, verify=lambda source: "def someName" in source)
+
+    assert ast.get_docstring(ast.parse(fixed)) == MODULE_DOCSTRING
+    assert "def someName():" in fixed
+    assert [message.symbol for message in result.messages] == ["invalid-name"]
@@ -0,0 +1,95 @@
+"""Batch mode: prompt files, per-job workspaces and summaries, with the model calls stubbed out."""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("colorama")
+pytest.importorskip("tqdm")
+pytest.importorskip("httpx")
+pytest.importorskip("openai")
+
+import batch  # noqa: E402
+from batch import load_prompts, run_batch  # noqa: E402
+from lint_service import LintMessage, LintResult  # noqa: E402
+from sandbox import SandboxPool  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+from stub_server import StubState, serve  # noqa: E402
+
+PASSING = "def double(x):\n    return 2 * x\n\n\nassert double(2) == 4\n"
+FAILING = "def double(x):\n    return x\n\n\nassert double(2) == 4\n"
+
+
+class StubLint:
+    """Lint service whose every result has one message the local fixes cannot handle."""
+
+    hits = 0
+
+    def lint(self, code, filename="generatedcode.py"):
+        return LintResult(5.0, [LintMessage("W0612", "unused-variable", 1, 0, "Unused variable 'x'")])
+
+
+def test_load_prompts_reads_blank_line_separated_blocks(tmp_path):
+    path = tmp_path / "prompts.txt"
+    path.write_bytes(b"Check a palindrome.\r\n\r\nPrint all interleavings\r\n  of two strings.\r\n\r\n\r\n")
+
+    assert load_prompts(str(path)) == ["Check a palindrome.", "Print all interleavings\n  of two strings."]
+
+
+def test_load_prompts_reads_a_json_list(tmp_path):
+    path = tmp_path / "prompts.json"
+    path.write_text(json.dumps(["Check a palindrome.", "Solve N-Queens."]))
+
+    assert load_prompts(str(path)) == ["Check a palindrome.", "Solve N-Queens."]
+
+
+def test_every_job_gets_its_workspace_and_summary(tmp_path, monkeypatch):
+    async def complete(self, messages, n, stage):
+        if stage == "lint":
+            raise ConnectionError("lint call failed")  # Handled by the lint stage, as in the interactive mode
+        return [FAILING if "failing" in messages[0]["content"] else PASSING] * n
+
+    monkeypatch.setattr(batch.BatchSession, "complete", complete)
+    output_dir = tmp_path / "runs"
+
+    with SandboxPool(size=1) as sandbox:
+        summaries = asyncio.run(run_batch(
+            ["a passing program", "a failing program"], str(output_dir), concurrency=2,
+            benchmark_settings={"warmup": 0, "repeats": 2, "scaling": False}, sandbox=sandbox,
+            lint_service=StubLint(),
+        ))
+
+    assert [summary["status"] for summary in summaries] == ["passed", "failed"]
+    assert summaries[0]["lint_clean"] is False
+    assert set(summaries[0]["stages"]) == {"generate", "optimize", "lint"}
+    assert set(summaries[1]["stages"]) == {"generate"}
+    assert json.loads((output_dir / "summary.json").read_text()) == summaries
+    for job_id, code in (("job-001", PASSING), ("job-002", FAILING)):
+        workspace = output_dir / job_id
+        assert json.loads((workspace / "summary.json").read_text())["workspace"] == str(workspace)
+        assert (workspace / "generatedcode.py").read_text() == code
+    assert (output_dir / "trace.jsonl").exists()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_jobs_call_the_stub_server_through_the_async_client(tmp_path, monkeypatch, stream):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    state = StubState()
+    server = serve(port=0, state=state)
+    scheduler = RequestScheduler(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+
+    try:
+        with SandboxPool(size=1) as sandbox:
+            # One job: its stage thread waits on a model call that must still get through
+            summaries = asyncio.run(run_batch(
+                ["Check a palindrome."], str(tmp_path), concurrency=1, stream=stream,
+                benchmark_settings={"warmup": 0, "repeats": 2, "scaling": False}, sandbox=sandbox,
+                scheduler=scheduler, lint_service=StubLint(),
+            ))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert summaries[0]["status"] == "passed", summaries[0]["error"]
+    assert state.counts["200"] >= 3  # generate, optimize and the lint attempts
+    assert "def is_palindrome" in (tmp_path / "job-001" / "generatedcode.py").read_text()
@@ -0,0 +1,130 @@
+import random
+
+import pytest
+
+import benchmark
+from benchmark import bootstrap_ci, compare_programs, compare_scaling
+from sandbox import CAN_FORK
+
+
+def timings(center, count=30, seed=0):
+    rng = random.Random(seed)
+    return [center * rng.uniform(0.95, 1.05) for _ in range(count)]
+
+
+def test_interval_of_identical_versions_contains_no_change():
+    old = timings(1.0, seed=1)
+    new = timings(1.0, seed=2)
+
+    low, high = bootstrap_ci(old, new)
+
+    assert low < 0 < high
+
+
+def test_interval_of_a_faster_version_is_negative():
+    low, high = bootstrap_ci(timings(1.0, seed=1), timings(0.5, seed=2))
+
+    assert low <= high < 0
+    assert -0.55 < low and high < -0.45
+
+
+def test_interval_is_reproducible_with_a_seed():
+    old, new = timings(1.0, seed=1), timings(0.9, seed=2)
+
+    assert bootstrap_ci(old, new, seed=7) == bootstrap_ci(old, new, seed=7)
+
+
+def test_wider_confidence_gives_a_wider_interval():
+    old, new = timings(1.0, seed=1), timings(0.9, seed=2)
+
+    low_90, high_90 = bootstrap_ci(old, new, confidence=0.90)
+    low_99, high_99 = bootstrap_ci(old, new, confidence=0.99)
+
+    assert low_99 <= low_90 and high_90 <= high_99
+
+
+def scaling_profile(old_centers, new_centers, results_match=True):
+    """A profile_scaling result with timings around the given medians, one per size."""
+    sizes = [2 ** power for power in range(len(old_centers))]
+    samples = {size: timings(center, seed=size) for size, center in zip(sizes, old_centers)}
+    other_samples = {size: timings(center, seed=size + 1) for size, center in zip(sizes, new_centers)}
+    return {
+        "function": "solve", "kind": "list", "checks": {"results_match": results_match},
+        "samples": samples, "points": {size: min(values) for size, values in samples.items()},
+        "other_samples": other_samples, "other_points": {size: min(values) for size, values in other_samples.items()},
+        "timed_out": False, "error": None,
+    }
+
+
+def test_scaling_win_holds_at_the_largest_sizes():
+    comparison = compare_scaling(scaling_profile([1, 2, 4, 8, 16], [1, 2, 3, 4, 5]))
+
+    assert comparison["faster"] and not comparison["slower"]
+    assert comparison["largest_common_size"] == 16
+    assert comparison["old_exponent"] > comparison["new_exponent"]
+
+
+def test_scaling_win_at_the_largest_size_only_does_not_count():
+    comparison = compare_scaling(scaling_profile([1, 2, 4, 8, 16], [1, 2, 4, 8, 8]))
+
+    assert comparison["sizes"][16]["faster"]
+    assert not comparison["faster"]
+
+
+def test_scaling_needs_matching_results_and_two_sizes():
+    assert not compare_scaling(scaling_profile([1, 2, 4, 8], [0.5, 0.5, 0.5, 0.5], results_match=False))["faster"]
+    assert not compare_scaling(scaling_profile([10], [1]))["faster"]
+
+
+@pytest.mark.parametrize("new_wall, new_scaling, accept", [
+    (0.5, [1, 2, 4, 8], True),  # Faster program
+    (1.0, [1, 1, 1, 1], True),  # Same program time, faster at the largest sizes
+    (2.0, [1, 1, 1, 1], False),  # Slower program outweighs a scaling win
+    (1.0, [1, 2, 4, 8], False),  # No difference anywhere
+])
+def test_accept_logic(monkeypatch, new_wall, new_scaling, accept):
+    walls = {"old.py": iter(timings(1.0, seed=1)), "new.py": iter(timings(new_wall, seed=2))}
+    monkeypatch.setattr(benchmark, "run_script_once", lambda code_file: {
+        "wall": next(walls[code_file]), "cpu": None, "max_rss_kb": None, "returncode": 0,
+    })
+    monkeypatch.setattr(benchmark, "profile_scaling", lambda *args, **kwargs: scaling_profile([1, 2, 4, 8], new_scaling))
+
+    report = compare_programs("old.py", "new.py", warmup=0, repeats=20)
+
+    assert report["accept"] is accept
+
+
+def test_report_keeps_a_profile_without_a_function(monkeypatch):
+    walls = iter(timings(1.0, count=4))
+    monkeypatch.setattr(benchmark, "run_script_once", lambda code_file: {
+        "wall": next(walls), "cpu": None, "max_rss_kb": None, "returncode": 0,
+    })
+    profile = dict(scaling_profile([], []), function=None, timed_out=True, error="no benchmarkable function found")
+    monkeypatch.setattr(benchmark, "profile_scaling", lambda *args, **kwargs: profile)
+
+    report = compare_programs("old.py", "new.py", warmup=0, repeats=2)
+
+    assert not report["accept"]
+    assert report["scaling"]["comparison"] is None
+    assert report["scaling"]["profile"]["timed_out"]
+    assert report["scaling"]["profile"]["error"] == "no benchmarkable function found"
+
+
+@pytest.mark.skipif(not CAN_FORK, reason="the warm workers need fork")
+def test_exponential_function_stops_growing_within_the_budget(tmp_path):
+    code_file = tmp_path / "queens.py"
+    code_file.write_text(
+        "def count_queens(n, row=0, columns=()):\n"
+        "    if row == n:\n"
+        "        return 1\n"
+        "    return sum(count_queens(n, row + 1, columns + (column,)) for column in range(n)\n"
+        "               if all(column != other and abs(column - other) != row - index\n"
+        "                      for index, other in enumerate(columns)))\n"
+    )
+
+    profile = benchmark.profile_scaling(str(code_file), str(code_file), time_budget=2.0)
+
+    assert profile["function"] == "count_queens" and profile["kind"] == "int"
+    assert profile["checks"]["results_match"]
+    assert profile["error"] is None
+    assert 4 in profile["points"] and 64 not in profile["points"]
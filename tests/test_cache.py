@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+from cache import ReplayMiss, ResponseCache, cache_key
+
+MODEL = "gpt-4o-mini"
+
+
+def messages(number):
+    return [{"role": "user", "content": f"prompt {number}"}]
+
+
+def age(cache, number, seconds):
+    """Make the entry of a prompt look `seconds` old."""
+    path = cache._path(cache_key(MODEL, messages(number)))
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=3)
+    for number in range(3):
+        cache.put(MODEL, messages(number), f"answer {number}")
+        age(cache, number, 100 - number)
+    assert cache.get(MODEL, messages(0)) == "answer 0"  # Now the most recently used
+
+    cache.put(MODEL, messages(3), "answer 3")
+
+    assert cache.get(MODEL, messages(1)) is None
+    assert [cache.get(MODEL, messages(number)) for number in (0, 2, 3)] == ["answer 0", "answer 2", "answer 3"]
+
+
+def test_evicts_entries_over_the_size_limit(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=None, max_bytes=1500)
+    for number in range(4):
+        cache.put(MODEL, messages(number), "x" * 400)
+        age(cache, number, 100 - number)
+    cache.evict()
+
+    remaining = [number for number in range(4) if cache.get(MODEL, messages(number)) is not None]
+    assert remaining and remaining == list(range(4 - len(remaining), 4))
+    assert sum(entry.stat().st_size for entry in tmp_path.iterdir()) <= 1500
+
+
+def test_drops_expired_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_age=60)
+    cache.put(MODEL, messages(0), "old")
+    cache.put(MODEL, messages(1), "new")
+    age(cache, 0, 120)
+
+    cache.evict()
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert cache.get(MODEL, messages(0)) is None
+    assert cache.get(MODEL, messages(1)) == "new"
+
+
+def test_fetch_calls_the_model_once(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    calls = []
+
+    def call():
+        calls.append(True)
+        return "answer"
+
+    assert cache.fetch(MODEL, messages(0), call) == "answer"
+    assert cache.fetch(MODEL, messages(0), call) == "answer"
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_fresh_fetch_skips_the_lookup_but_records(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put(MODEL, messages(0), "first", attempt=1)
+
+    assert cache.fetch(MODEL, messages(0), lambda: "second", fresh=True, attempt=1) == "second"
+    assert cache.get(MODEL, messages(0), attempt=1) == "second"
+    assert cache.get(MODEL, messages(0)) is None  # Retries are keyed apart
+
+
+def test_replay_serves_recorded_responses_only(tmp_path):
+    ResponseCache(str(tmp_path)).put(MODEL, messages(0), "recorded")
+    cache = ResponseCache(str(tmp_path), replay=True)
+
+    assert cache.fetch(MODEL, messages(0), lambda: "new", fresh=True) == "recorded"
+    with pytest.raises(ReplayMiss):
+        cache.fetch(MODEL, messages(1), lambda: "new")
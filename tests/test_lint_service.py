@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from lint_service import LintMessage, LintResult, LintService
+
+CODE = "import os\n\n\ndef addOne(value):\n    return value + 1\n"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """A service whose pylint runs are counted and return a fixed result."""
+    service = LintService(max_entries=2)
+    service.runs = []
+
+    def run_pylint(code, filename):
+        service.runs.append((code, filename))
+        return LintResult(5.0, [LintMessage("W0611", "unused-import", 1, 0, "Unused import os")])
+
+    monkeypatch.setattr(service, "_run_pylint", run_pylint)
+    return service
+
+
+def test_same_code_is_linted_once(service):
+    first = service.lint(CODE)
+    second = service.lint(CODE)
+
+    assert first == second
+    assert len(service.runs) == 1
+    assert (service.hits, service.misses) == (1, 1)
+
+
+def test_file_name_and_code_are_part_of_the_key(service):
+    service.lint(CODE)
+    service.lint(CODE, filename="other.py")
+    service.lint(CODE + "\n")
+
+    assert len(service.runs) == 3
+    assert service.hits == 0
+
+
+def test_least_recently_used_result_is_evicted(service):
+    service.lint("a = 1\n")
+    service.lint("b = 2\n")
+    service.lint("a = 1\n")  # Hit, "b = 2" is now the oldest
+    service.lint("c = 3\n")
+    service.lint("a = 1\n")
+    service.lint("b = 2\n")
+
+    assert [code for code, _ in service.runs] == ["a = 1\n", "b = 2\n", "c = 3\n", "b = 2\n"]
+
+
+def test_concurrent_lints_of_the_same_code_agree(service):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.lint(CODE))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8 and all(result == results[0] for result in results)
+    assert service.hits + service.misses == 8
+
+
+def test_result_text_reads_like_pylint():
+    result = LintResult(5.0, [LintMessage("W0611", "unused-import", 1, 0, "Unused import os")])
+
+    assert result.text("job.py") == (
+        "job.py:1:0: W0611: Unused import os (unused-import)\nYour code has been rated at 5.00/10"
+    )
+    assert not result.clean
+    assert LintResult(10.0, []).clean
+
+
+def test_real_pylint_reports_score_and_messages():
+    pytest.importorskip("pylint")
+    service = LintService()
+
+    result = service.lint(CODE)
+
+    symbols = {message.symbol for message in result.messages}
+    assert {"missing-module-docstring", "unused-import", "invalid-name"} <= symbols
+    assert all(isinstance(message, LintMessage) for message in result.messages)
+    assert result.score < 10 and not result.clean
+    assert service.lint(CODE) == result and service.hits == 1
+
+    clean = service.lint('"""Add one."""\n\n\ndef add_one(value):\n    """Add one to value."""\n    return value + 1\n')
+    assert clean.clean and not clean.messages
@@ -0,0 +1,70 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from sandbox import CAN_FORK, SandboxPool
+
+pytestmark = pytest.mark.skipif(not CAN_FORK, reason="the warm workers need fork")
+
+
+@pytest.fixture
+def pool():
+    with SandboxPool(size=1, timeout=5.0) as pool:
+        yield pool
+
+
+def test_code_runs_as_main_in_its_directory(pool, tmp_path):
+    result = pool.run("import os, sys\nprint(__name__, os.getcwd(), sys.argv[0])\n", cwd=str(tmp_path), filename="job.py")
+
+    assert result["returncode"] == 0 and not result["timed_out"]
+    assert result["stdout"].split() == ["__main__", str(tmp_path), os.path.join(str(tmp_path), "job.py")]
+
+
+def test_runs_do_not_leak_into_each_other(pool):
+    pool.run("import json\njson.leaked = True\n")
+
+    assert pool.run("import json\nprint(hasattr(json, 'leaked'))\n")["stdout"] == "False\n"
+
+
+def test_runaway_code_is_killed_at_the_timeout(pool):
+    result = pool.run("print('started', flush=True)\nwhile True:\n    pass\n", timeout=0.5)
+
+    assert result["timed_out"]
+    assert result["returncode"] == -signal.SIGKILL
+    assert result["stdout"] == "started\n"
+    assert "TimeoutError" in result["stderr"]
+    assert result["wall"] < 3
+
+
+def test_cpu_time_is_limited():
+    with SandboxPool(size=1, timeout=10.0, cpu_seconds=1) as pool:
+        result = pool.run("while True:\n    pass\n")
+
+    assert not result["timed_out"]
+    assert result["returncode"] == -signal.SIGXCPU
+    assert "CPU time limit of 1s" in result["stderr"]
+
+
+def test_address_space_is_limited():
+    with SandboxPool(size=1, memory_mb=256) as pool:
+        result = pool.run("data = bytearray(512 * 1024 * 1024)\n")
+
+    assert result["returncode"] == 1
+    assert "MemoryError" in result["stderr"]
+
+
+def test_dead_worker_is_reported_and_replaced(pool):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(pool.run("import time\ntime.sleep(2)\n")))
+    thread.start()
+    time.sleep(0.5)
+    pool._workers[0].process.kill()
+    thread.join()
+
+    assert results[0]["returncode"] == -signal.SIGKILL
+    assert "Sandbox worker died" in results[0]["stderr"]
+    assert len(pool._workers) == 1
+    assert pool.run("print('still working')\n")["stdout"] == "still working\n"
@@ -0,0 +1,184 @@
+"""The request scheduler against the local stub server: 429s, 500s and Retry-After."""
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip("httpx")
+openai = pytest.importorskip("openai")
+
+import scheduler as scheduler_module  # noqa: E402
+from scheduler import RequestScheduler, retry_after  # noqa: E402
+from streaming import stream_completion, stream_completion_async  # noqa: E402
+from stub_server import StubState, serve  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Write a palindrome check."}]
+
+
+class StatusError(Exception):
+    """A failed request, shaped like openai.APIStatusError: status_code and response.headers."""
+
+    def __init__(self, error):
+        super().__init__(f"HTTP {error.code}")
+        self.status_code = error.code
+        self.response = type("Response", (), {"headers": {name.lower(): value for name, value in error.headers.items()}})
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(state):
+        server = serve(port=0, state=state)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(url):
+    request = urllib.request.Request(
+        url, json.dumps({"model": "stub", "messages": MESSAGES}).encode("utf-8"), {"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise StatusError(e) from None
+
+
+def test_calls_succeed_through_server_errors(stub, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "BASE_BACKOFF", 0.01)
+    random.seed(3)
+    state = StubState(error_rate=0.4)
+    url = stub(state)
+    scheduler = RequestScheduler(rpm=0, tpm=0, max_retries=20)
+
+    for _ in range(10):
+        response = scheduler.call(lambda: post(url), MESSAGES, usage_of=lambda response: response["usage"])
+        assert "def is_palindrome" in response["choices"][0]["message"]["content"]
+
+    assert state.counts["200"] == 10
+    assert state.counts["500"] > 0
+    assert scheduler.retries == state.counts["500"]
+    assert scheduler.throttled == 0
+
+
+def test_rate_limited_call_waits_for_retry_after(stub):
+    state = StubState(rpm=2, window=1.0)
+    url = stub(state)
+    scheduler = RequestScheduler(rpm=0, tpm=0)
+
+    start_time = time.monotonic()
+    finished = []
+    for _ in range(3):
+        scheduler.call(lambda: post(url), MESSAGES)
+        finished.append(time.monotonic() - start_time)
+
+    assert state.counts["200"] == 3
+    assert state.counts["429"] >= 1
+    assert scheduler.throttled == state.counts["429"]
+    # The third request only fits once the first one has left the one second window
+    assert finished[1] < 0.5
+    assert finished[2] >= 0.9
+
+
+def test_calls_queued_behind_a_pause_are_admitted_together():
+    scheduler = RequestScheduler(rpm=600, tpm=0)
+    scheduler._paused_until = time.monotonic() + 0.3
+    start_time = time.monotonic()
+    admitted = []
+
+    def call():
+        scheduler.call(lambda: admitted.append(time.monotonic() - start_time), MESSAGES)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitted) == 8
+    assert min(admitted) >= 0.3
+    assert max(admitted) - min(admitted) < 0.1
+
+
+def base_url(url):
+    return url[:-len("/chat/completions")]
+
+
+def test_openai_client_honours_retry_after_of_api_errors(stub):
+    state = StubState(rpm=1, window=1.0)
+    scheduler = RequestScheduler(rpm=0, tpm=0, base_url=base_url(stub(state)))
+    client = scheduler.openai_client("stub")
+
+    def request():
+        return client.chat.completions.create(model="stub", messages=MESSAGES)
+
+    scheduler.call(request, MESSAGES, usage_of=lambda response: response.usage)
+    with pytest.raises(openai.RateLimitError) as error:
+        request()
+    assert 0 < retry_after(error.value) <= 1.0
+
+    start_time = time.monotonic()
+    response = scheduler.call(request, MESSAGES, usage_of=lambda response: response.usage)
+
+    assert "def is_palindrome" in response.choices[0].message.content
+    assert state.counts["200"] == 2
+    assert state.counts["429"] >= 2  # The direct request above, then at least one throttled call
+    assert scheduler.throttled == state.counts["429"] - 1
+    assert time.monotonic() - start_time >= 0.5
+    client.close()
+
+
+def test_streamed_calls_go_through_the_scheduler(stub):
+    state = StubState(rpm=2, window=1.0)
+    scheduler = RequestScheduler(rpm=0, tpm=0, base_url=base_url(stub(state)))
+    client = scheduler.openai_client("stub")
+
+    results = [
+        stream_completion(client, "stub", MESSAGES, send=lambda request, usage_of: scheduler.call(
+            request, MESSAGES, model="stub", usage_of=usage_of
+        ))
+        for _ in range(3)
+    ]
+
+    for code, stats in results:
+        assert "def is_palindrome" in code
+        assert stats["valid"] and stats["usage"]["completion_tokens"] > 0
+    assert state.counts["200"] == 3
+    assert state.counts["429"] >= 1
+    assert scheduler.throttled == state.counts["429"]
+    client.close()
+
+
+def test_async_streamed_calls_go_through_the_scheduler(stub):
+    state = StubState(rpm=2, window=1.0)
+    scheduler = RequestScheduler(rpm=0, tpm=0, base_url=base_url(stub(state)))
+
+    async def run():
+        client = scheduler.async_openai_client("stub")
+        try:
+            return await asyncio.gather(*(
+                stream_completion_async(client, "stub", MESSAGES, send=lambda request, usage_of: scheduler.call_async(
+                    request, MESSAGES, model="stub", usage_of=usage_of
+                ))
+                for _ in range(3)
+            ))
+        finally:
+            await client.close()
+
+    results = asyncio.run(run())
+
+    assert all("def is_palindrome" in code and stats["valid"] for code, stats in results)
+    assert state.counts["200"] == 3
+    assert state.counts["429"] >= 1
+    assert scheduler.throttled == state.counts["429"]
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+
+from speculative import race, race_async, raise_if_cancelled
+from tracing import tracer
+
+
+def check(candidate):
+    """Candidates: "fail" raises, "slow" runs until cancelled, a number is its own result."""
+    with tracer.span("check", candidate=str(candidate)):
+        if candidate == "fail":
+            raise ValueError("broken candidate")
+        if candidate == "slow":
+            for _ in range(500):
+                raise_if_cancelled()
+                time.sleep(0.01)
+        return candidate
+
+
+async def check_async(candidate):
+    with tracer.span("check", candidate=str(candidate)):
+        if candidate == "fail":
+            raise ValueError("broken candidate")
+        if candidate == "slow":
+            for _ in range(500):
+                raise_if_cancelled()
+                await asyncio.sleep(0.01)
+        return candidate
+
+
+def outcomes():
+    return {span["attributes"]["candidate"]: span["outcome"] for span in tracer.spans if span["name"] == "check"}
+
+
+def run_race(race_function, candidates):
+    if race_function is race:
+        return race(check, candidates, accept=lambda result: result >= 10, score=lambda result: result)
+    return asyncio.run(race_async(check_async, candidates, accept=lambda result: result >= 10,
+                                  score=lambda result: result))
+
+
+@pytest.fixture(params=[race, race_async], ids=["race", "race_async"])
+def race_function(request):
+    tracer.clear()
+    yield request.param
+    tracer.clear()
+
+
+def test_accepted_result_cancels_the_other_checks(race_function):
+    start_time = time.perf_counter()
+
+    assert run_race(race_function, ["slow", 10]) == 10
+    assert time.perf_counter() - start_time < 2
+    # The race waited for the loser, which stopped at its next check
+    assert outcomes() == {"slow": "cancelled", "10": "ok"}
+    assert not any("error" in span["attributes"] for span in tracer.spans)
+
+
+def test_failed_check_counts_as_the_worst_candidate(race_function):
+    assert run_race(race_function, ["fail", 3, 5]) == 5
+    assert outcomes() == {"fail": "error", "3": "ok", "5": "ok"}
+
+
+def test_race_raises_only_when_every_check_failed(race_function):
+    with pytest.raises(ValueError, match="broken candidate"):
+        run_race(race_function, ["fail", "fail"])
@@ -0,0 +1,81 @@
+import pytest
+
+from streaming import StreamAborted, StreamValidator, extract_code
+
+CODE = "def double(x):\n    return 2 * x\n\n\nprint(double(2))\n"
+TESTS = "assert double(2) == 4\nassert double(0) == 0\n"
+
+
+@pytest.mark.parametrize("answer", [
+    CODE,
+    "```python\n" + CODE + "```\n",
+    "```\n" + CODE + "```\n",
+    "Here is the code:\n```python\n" + CODE + "```\nIt prints 4.\n",
+    "```python\n" + CODE,
+    CODE + "```\n",
+    "python\n" + CODE,
+    "```python\n" + CODE + "```\nOutput:\n```text\n4\n```\n",
+])
+def test_extract_code(answer):
+    assert extract_code(answer) == CODE
+
+
+@pytest.mark.parametrize("answer", [
+    "```python\n" + CODE + "```\nAnd the tests:\n```python\n" + TESTS + "```\n",
+    "Code:\n```\n" + CODE + "```\n\nTests:\n\n```py\n" + TESTS + "```\nDone.\n",
+    "```python\n" + CODE + "```\nRun it with:\n```bash\npython double.py\n```\n```python\n" + TESTS + "```\n",
+])
+def test_extract_code_keeps_every_python_block(answer):
+    assert extract_code(answer) == CODE + "\n\n" + TESTS
+
+
+def feed(validator, text, size=7):
+    """Feed text in small deltas, like a stream; returns True once the validator says it is complete."""
+    for start in range(0, len(text), size):
+        if validator.feed(text[start:start + size]):
+            return True
+    return False
+
+
+def test_fenced_answer_skips_the_prose_after_the_closing_fence():
+    validator = StreamValidator()
+
+    assert not feed(validator, "Sure:\n```python\n" + CODE + "```\nThis doubles 2, see `double(2)`.\n")
+    assert validator.finish() == CODE
+
+
+def test_fenced_answer_keeps_the_tests_in_a_second_block():
+    validator = StreamValidator(check_every=1)
+
+    assert not feed(validator, "```python\n" + CODE + "```\nAnd the tests:\n```bash\necho hi\n```\n"
+                               "```python\n" + TESTS + "```\nAll of them pass.\n")
+    assert validator.finish() == CODE + "\n\n" + TESTS
+
+
+def test_plain_answer_ends_at_prose_after_the_code():
+    validator = StreamValidator()
+
+    assert feed(validator, CODE + "\nThis program prints the double of 2.\nIt uses a function.\n")
+    assert validator.finish() == CODE
+
+
+def test_plain_answer_keeps_lines_that_only_look_like_prose():
+    code = "values = sorted(\n    [3, 1, 2],\n)\nprint(values)\n"
+    validator = StreamValidator()
+
+    assert not feed(validator, code)
+    assert validator.finish() == code
+
+
+def test_prose_only_answer_is_aborted():
+    validator = StreamValidator()
+
+    with pytest.raises(StreamAborted):
+        feed(validator, "I cannot help with that.\nPlease ask again.\nMaybe later.\nSorry about that.\n")
+
+
+def test_broken_code_is_aborted():
+    validator = StreamValidator(check_every=2)
+
+    with pytest.raises(StreamAborted):
+        feed(validator, "def f(:\n    return 1\nprint(f())\n")
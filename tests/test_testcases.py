@@ -0,0 +1,128 @@
+import os
+import textwrap
+
+import pytest
+
+from sandbox import CAN_FORK, SandboxPool
+from testcases import failure_report, run_tests, split_program
+
+PROGRAM = '''import unittest
+
+
+def add(a, b):
+    return a - b
+
+
+class TestAdd(unittest.TestCase):
+    def setUp(self):
+        self.zero = 0
+
+    def test_zero(self):
+        self.assertEqual(add(self.zero, 0), 0)
+
+    def test_wrong(self):
+        self.assertEqual(add(1, 2), 3)
+
+
+if __name__ == "__main__":
+    value = 2
+    assert add(value, 2) == 4
+    unittest.main()
+'''
+
+
+def line_of(code, text):
+    return code.splitlines().index(text) + 1
+
+
+def test_split_program_finds_each_test():
+    program = split_program(PROGRAM)
+
+    assert program.has_tests
+    assert [test.name for test in program.tests] == ["TestAdd.test_zero", "TestAdd.test_wrong", "line 21"]
+    assert "class TestAdd" not in program.implementation
+    assert "def add(a, b):" in program.implementation
+    assert program.code.startswith(program.implementation.rstrip())
+    assert line_of(program.code, "    assert add(value, 2) == 4") == 21
+
+
+def test_assert_tests_are_named_after_their_line_in_the_whole_program():
+    answer = "def add(a, b):\n    return a + b\n\n\n\n\n\nassert add(1, 1) == 2\n\n\n\ndef double(x):\n    return 2 * x\n"
+    program = split_program(answer)
+
+    assert [test.name for test in program.tests] == [f"line {line_of(program.code, 'assert add(1, 1) == 2')}"]
+    assert program.tests[0].name != "line 8"
+
+
+def test_main_guard_test_keeps_its_setup():
+    program = split_program(PROGRAM)
+    test = program.tests[-1]
+
+    assert test.source == "value = 2\nassert add(value, 2) == 4\n"
+    assert test.snippet == "assert add(value, 2) == 4\n"
+
+
+def test_program_without_tests_is_a_single_test():
+    program = split_program("print('hello')\n")
+
+    assert not program.has_tests
+    assert [test.name for test in program.tests] == ["program"]
+    assert program.program_for(program.tests[0]) == "print('hello')\n"
+
+
+def test_program_that_does_not_parse_is_a_single_test():
+    program = split_program("def broken(:\n    pass\n")
+
+    assert [test.name for test in program.tests] == ["program"]
+
+
+def test_with_implementation_keeps_tests_and_imports():
+    program = split_program(PROGRAM).with_implementation("def add(a, b):\n    return a + b\n")
+
+    assert "return a + b" in program.code
+    assert "import unittest" in program.implementation
+    assert [test.name for test in program.tests][:2] == ["TestAdd.test_zero", "TestAdd.test_wrong"]
+    # Assert tests are named after their line in the new program
+    assert program.tests[2].name == f"line {line_of(program.code, '    assert add(value, 2) == 4')}"
+
+
+def test_failure_report_uses_line_numbers_of_the_whole_program():
+    program = split_program(PROGRAM)
+    test = program.tests[1]
+    single = program.program_for(test)
+    stderr = textwrap.dedent(f'''\
+        F
+        ======================================================================
+        FAIL: test_wrong (__main__.TestAdd.test_wrong)
+        ----------------------------------------------------------------------
+        Traceback (most recent call last):
+          File "/work/generatedcode.py", line {line_of(single, "        self.assertEqual(add(1, 2), 3)")}, in test_wrong
+            self.assertEqual(add(1, 2), 3)
+        AssertionError: -1 != 3
+        ''')
+
+    report = failure_report(program, {test.name: {"stderr": stderr, "returncode": 1}}, "generatedcode.py")
+
+    expected = line_of(program.code, "        self.assertEqual(add(1, 2), 3)")
+    assert f'File "generatedcode.py", line {expected}, in test_wrong' in report
+    assert "AssertionError: -1 != 3" in report
+    assert "----" not in report
+
+
+@pytest.mark.skipif(not CAN_FORK, reason="the warm workers need fork")
+def test_failure_report_of_real_runs(tmp_path):
+    # A different program under the same name on disk must not leak into the tracebacks
+    (tmp_path / "generatedcode.py").write_text("def test_add():\n    pass\n" * 20)
+    program = split_program(PROGRAM)
+
+    with SandboxPool(size=1) as pool:
+        results = run_tests(program, program.tests, lambda code: pool.run(code, cwd=str(tmp_path)))
+    failures = {name: result for name, result in results.items() if result["returncode"]}
+    report = failure_report(program, failures, "generatedcode.py")
+
+    assert sorted(failures) == ["TestAdd.test_wrong", "line 21"]
+    wrong = line_of(program.code, "        self.assertEqual(add(1, 2), 3)")
+    assert f'File "generatedcode.py", line {wrong}, in test_wrong\n    self.assertEqual(add(1, 2), 3)' in report
+    assert 'File "generatedcode.py", line 21, in <module>\n    assert add(value, 2) == 4' in report
+    assert "def test_add" not in report
+    assert os.path.exists(tmp_path / "generatedcode.py")
@@ -0,0 +1,94 @@
+import asyncio
+import contextvars
+import json
+import threading
+
+import pytest
+
+from tracing import Tracer, annotate, record_usage, traced, tracer
+
+
+@pytest.fixture
+def spans():
+    """A tracer with a model call inside a stage, a failed run and an async traced call."""
+    recorder = Tracer()
+    with recorder.span("generate", job_id="job-001"):
+        annotate(attempts=2)
+        with recorder.span("model_call", model="stub", prompt_bytes=120):
+            record_usage({"prompt_tokens": 30, "completion_tokens": 50, "total_tokens": 80})
+            record_usage(type("Usage", (), {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})())
+            annotate(response_bytes=300)
+        with recorder.span("tests"):
+            annotate(outcome="failed")
+    with pytest.raises(ValueError):
+        with recorder.span("execute"):
+            raise ValueError("boom")
+    return recorder
+
+
+def test_spans_nest_and_export_as_json_lines(spans, tmp_path):
+    path = tmp_path / "trace.jsonl"
+    spans.export_jsonl(str(path))
+
+    exported = {span["name"]: span for span in map(json.loads, path.read_text().splitlines())}
+    assert sorted(exported) == ["execute", "generate", "model_call", "tests"]
+    generate = exported["generate"]
+    assert generate["parent_id"] is None and generate["attributes"] == {"job_id": "job-001", "attempts": 2}
+    assert exported["model_call"]["parent_id"] == generate["span_id"]
+    assert exported["model_call"]["attributes"]["prompt_tokens"] == 40
+    assert exported["model_call"]["attributes"]["completion_tokens"] == 55
+    assert exported["tests"]["outcome"] == "failed"
+    assert exported["execute"]["outcome"] == "error"
+    assert exported["execute"]["attributes"]["error"] == "ValueError('boom')"
+    assert all(span["duration"] >= 0 for span in exported.values())
+
+
+def test_prometheus_export(spans, tmp_path):
+    path = tmp_path / "metrics.prom"
+    spans.export_prometheus(str(path))
+
+    lines = path.read_text().splitlines()
+    samples = dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+    assert samples['spc_span_duration_seconds_count{span="generate"}'] == "1"
+    assert float(samples['spc_span_duration_seconds_sum{span="model_call"}']) >= 0
+    assert samples['spc_span_outcomes_total{span="execute",outcome="error"}'] == "1"
+    assert samples['spc_span_outcomes_total{span="tests",outcome="failed"}'] == "1"
+    assert samples['spc_attempts_total{span="generate"}'] == "2"
+    assert samples['spc_tokens_total{span="model_call",kind="prompt"}'] == "40"
+    assert samples['spc_tokens_total{span="model_call",kind="completion"}'] == "55"
+    assert samples['spc_payload_bytes_total{span="model_call",kind="response"}'] == "300"
+    # Every metric is declared once, even the ones with several kinds
+    declared = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    assert len(declared) == len(set(declared)) == 5
+
+
+def test_summary_table_counts_errors(spans):
+    table = spans.summary_table().splitlines()
+
+    rows = {line.split()[0]: line.split() for line in table[2:]}
+    assert set(rows) == {"execute", "generate", "model_call", "tests"}
+    assert rows["execute"][5] == "1"
+    assert rows["model_call"][-1] == "40/55"
+
+
+def test_spans_nest_across_threads_and_tasks():
+    tracer.clear()
+
+    @traced("check")
+    def check():
+        annotate(thread=threading.current_thread().name)
+
+    @traced("check_async")
+    async def check_async():
+        annotate(task=True)
+
+    with tracer.span("race") as race:
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(check,))
+        thread.start()
+        thread.join()
+        asyncio.run(check_async())
+
+    children = {span["name"]: span for span in tracer.spans if span["parent_id"] == race["span_id"]}
+    assert set(children) == {"check", "check_async"}
+    assert children["check_async"]["attributes"] == {"task": True}
+    tracer.clear()
@@ -0,0 +1,221 @@
+"""
+Per-stage tracing and metrics for the generate/optimize/lint pipeline.
+
+Every stage, model call, lint run and program execution is recorded as a
+span: a name, a duration, an outcome and free-form attributes such as the
+attempt number, token usage or prompt/response sizes. Spans nest through a
+context variable, so they work the same across threads and asyncio tasks.
+
+The recorded spans can be exported as JSON lines, as a Prometheus text
+format file, or printed as a summary table at the end of a run.
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Tracer:
+    """Collects finished spans."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Record the enclosed block as a span.
+
+        The outcome is "ok" unless the block raises ("error", or the outcome
+        attribute of the exception class, e.g. "cancelled") or sets another one
+        with annotate(outcome=...).
+
+        Yields:
+            dict: The span, whose "attributes" can still be updated.
+        """
+        parent = _current_span.get()
+        span = {
+            "name": name,
+            "span_id": next(_span_ids),
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time(),
+            "duration": None,
+            "outcome": None,
+            "attributes": dict(attributes),
+        }
+        token = _current_span.set(span)
+        start_time = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["outcome"] = getattr(e, "outcome", "error")
+            if span["outcome"] == "error":
+                span["attributes"]["error"] = repr(e)
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - start_time
+            if span["outcome"] is None:
+                span["outcome"] = "ok"
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def clear(self):
+        """Forget every recorded span."""
+        with self._lock:
+            self.spans = []
+
+    def export_jsonl(self, path):
+        """Write one JSON object per span."""
+        with open(path, "w", encoding="utf-8") as file:
+            for span in list(self.spans):
+                file.write(json.dumps(span, default=str) + "\n")
+
+    def aggregate(self):
+        """Per span name: count, total/max duration, errors, attempts, tokens and bytes."""
+        rows = {}
+        for span in list(self.spans):
+            row = rows.setdefault(span["name"], {
+                "count": 0, "total": 0.0, "max": 0.0, "errors": 0, "outcomes": {},
+                "attempts": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "prompt_bytes": 0, "response_bytes": 0,
+            })
+            attributes = span["attributes"]
+            row["count"] += 1
+            row["total"] += span["duration"]
+            row["max"] = max(row["max"], span["duration"])
+            row["errors"] += span["outcome"] == "error"
+            row["outcomes"][span["outcome"]] = row["outcomes"].get(span["outcome"], 0) + 1
+            for key in ("attempts", "prompt_tokens", "completion_tokens", "prompt_bytes", "response_bytes"):
+                row[key] += attributes.get(key) or 0
+        return rows
+
+    def export_prometheus(self, path, prefix="spc"):
+        """Write the aggregated metrics in the Prometheus text exposition format."""
+        rows = self.aggregate()
+        lines = [
+            f"# HELP {prefix}_span_duration_seconds Time spent in each pipeline span.",
+            f"# TYPE {prefix}_span_duration_seconds summary",
+        ]
+        for name, row in sorted(rows.items()):
+            lines.append(f'{prefix}_span_duration_seconds_sum{{span="{name}"}} {row["total"]:.6f}')
+            lines.append(f'{prefix}_span_duration_seconds_count{{span="{name}"}} {row["count"]}')
+        lines += [
+            f"# HELP {prefix}_span_outcomes_total Finished spans by outcome.",
+            f"# TYPE {prefix}_span_outcomes_total counter",
+        ]
+        for name, row in sorted(rows.items()):
+            for outcome, count in sorted(row["outcomes"].items()):
+                lines.append(f'{prefix}_span_outcomes_total{{span="{name}",outcome="{outcome}"}} {count}')
+        counters = [
+            ("attempts_total", "attempts", "Attempts made inside each span."),
+            ("tokens_total", "prompt_tokens", "Model tokens used, by kind."),
+            ("tokens_total", "completion_tokens", None),
+            ("payload_bytes_total", "prompt_bytes", "Bytes sent to and received from the model."),
+            ("payload_bytes_total", "response_bytes", None),
+        ]
+        for metric, key, help_text in counters:
+            if help_text:
+                lines += [
+                    f"# HELP {prefix}_{metric} {help_text}",
+                    f"# TYPE {prefix}_{metric} counter",
+                ]
+            label = f',kind="{key.split("_")[0]}"' if metric != "attempts_total" else ""
+            for name, row in sorted(rows.items()):
+                if row[key]:
+                    lines.append(f'{prefix}_{metric}{{span="{name}"{label}}} {row[key]}')
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def summary_table(self):
+        """Render the aggregated metrics as a plain text table."""
+        header = ("span", "count", "total s", "mean s", "max s", "errors", "attempts", "tokens in/out")
+        table = [header]
+        for name, row in sorted(self.aggregate().items(), key=lambda item: -item[1]["total"]):
+            table.append((
+                name,
+                str(row["count"]),
+                f"{row['total']:.2f}",
+                f"{row['total'] / row['count']:.3f}",
+                f"{row['max']:.3f}",
+                str(row["errors"]),
+                str(row["attempts"] or ""),
+                f"{row['prompt_tokens']}/{row['completion_tokens']}" if row["prompt_tokens"] else "",
+            ))
+        widths = [max(len(line[column]) for line in table) for column in range(len(header))]
+        rendered = [
+            "  ".join(cell.ljust(width) if column == 0 else cell.rjust(width)
+                      for column, (cell, width) in enumerate(zip(line, widths)))
+            for line in table
+        ]
+        rendered.insert(1, "-" * len(rendered[0]))
+        return "\n".join(rendered)
+
+
+tracer = Tracer()
+
+
+def annotate(**attributes):
+    """Add attributes to the current span; outcome=... sets its outcome."""
+    span = _current_span.get()
+    if span is None:
+        return
+    if "outcome" in attributes:
+        span["outcome"] = attributes.pop("outcome")
+    span["attributes"].update(attributes)
+
+
+def record_usage(usage):
+    """Add the token counts of an OpenAI `usage` object to the current span."""
+    if usage is None:
+        return
+    span = _current_span.get()
+    if span is None:
+        return
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = getattr(usage, key, None)
+        if value is None and isinstance(usage, dict):
+            value = usage.get(key)
+        if value is not None:
+            span["attributes"][key] = span["attributes"].get(key, 0) + value
+
+
+def traced(name):
+    """Decorator recording every call of a function, sync or async, as a span."""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_tracing_arguments(parser):
+    """Add the tracing export command line options to an argparse parser."""
+    group = parser.add_argument_group("tracing")
+    group.add_argument("--trace-jsonl", metavar="PATH", help="write every span as JSON lines")
+    group.add_argument("--metrics", metavar="PATH", help="write Prometheus text format metrics")
+
+
+def export_from_args(args):
+    """Export the recorded spans where the parsed command line options ask for."""
+    if args.trace_jsonl:
+        tracer.export_jsonl(args.trace_jsonl)
+    if args.metrics:
+        tracer.export_prometheus(args.metrics)